@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import geopandas as gpd
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import coo_matrix
+from routing import CompiledGraph
+
+# Constants
+MAX_HOMES_PER_FDH = 432  # Ports per FDH cabinet
+K_NEAREST = 5  # Each home may be assigned to one of its K nearest FDHs by routed cost
+
+def nearest_fdhs(graph, fdh_idx, home_idx, k):
+    """Return (costs, fdh positions), each of shape (homes, k), for the k cheapest FDHs of every home.
+
+    One Dijkstra per FDH is run in memory-bounded batches and only the running k best are
+    kept, so the full home x FDH matrix is never held.
+    """
+    best_cost = np.full((len(home_idx), k), np.inf)
+    best_fdh = np.full((len(home_idx), k), -1)
+    offset = 0
+    for batch, dist in graph.distances(fdh_idx):
+        batch_cost = dist[:, home_idx].T
+        batch_fdh = np.broadcast_to(np.arange(offset, offset + len(batch)), batch_cost.shape)
+        offset += len(batch)
+        cost = np.hstack((best_cost, batch_cost))
+        fdh = np.hstack((best_fdh, batch_fdh))
+        keep = np.argpartition(cost, k - 1, axis=1)[:, :k] if cost.shape[1] > k else np.argsort(cost, axis=1)
+        best_cost = np.take_along_axis(cost, keep, axis=1)
+        best_fdh = np.take_along_axis(fdh, keep, axis=1)
+    return best_cost, best_fdh
+
+def assign_homes(costs, fdhs, current, capacity, n_fdhs):
+    """Solve the capacitated home-to-FDH assignment as a min-cost transportation problem.
+
+    Every home may take any of its candidate FDHs or keep its current one, so the problem is
+    always feasible. The constraint matrix is totally unimodular, so the HiGHS simplex
+    solution is integral. Returns the chosen FDH position for every home.
+    """
+    n_homes = len(current)
+    home = np.repeat(np.arange(n_homes), costs.shape[1])
+    fdh = fdhs.ravel()
+    cost = costs.ravel()
+    usable = (fdh >= 0) & np.isfinite(cost)
+
+    # The current FDH is always allowed, at a penalty if it is not reachable
+    penalty = (cost[usable].max(initial=0) + 1) * 10
+    current_cost = np.full(n_homes, penalty)
+    listed = usable & (fdh == current[home])
+    current_cost[home[listed]] = cost[listed]
+    home = np.concatenate((home[usable & ~listed], np.arange(n_homes)))
+    fdh = np.concatenate((fdh[usable & ~listed], current))
+    cost = np.concatenate((cost[usable & ~listed], current_cost))
+
+    variables = np.arange(len(cost))
+    ones = np.ones(len(cost))
+    A_eq = coo_matrix((ones, (home, variables)), shape=(n_homes, len(cost))).tocsr()
+    A_ub = coo_matrix((ones, (fdh, variables)), shape=(n_fdhs, len(cost))).tocsr()
+    result = linprog(cost, A_ub=A_ub, b_ub=np.broadcast_to(capacity, n_fdhs), A_eq=A_eq, b_eq=np.ones(n_homes), bounds=(0, 1), method='highs')
+    if result.status != 0:
+        print(f"Assignment failed: {result.message}")
+        return current
+
+    # The solution is integral, so each home has exactly one variable set to 1
+    taken = result.x > 0.5
+    chosen = current.copy()
+    chosen[home[taken]] = fdh[taken]
+    return chosen
+
+print("Assigning homes to FDHs by routed cost...")
+
+# Load shapefiles
+edges_gdf = gpd.read_file('edges.shp')
+nodes_gdf = gpd.read_file('nodes.shp')
+home_points_gdf = gpd.read_file('home_points.shp')
+fdh_gdf = gpd.read_file('fdh.shp')
+
+graph = CompiledGraph(edges_gdf, terminal_nodes=nodes_gdf.loc[nodes_gdf['type'] == 'HP', 'id'])
+fdh_idx = graph.index_of(fdh_gdf['node_id'])
+home_idx = graph.index_of(home_points_gdf['drop_point'])
+fdh_position = {fdh_id: i for i, fdh_id in enumerate(fdh_gdf['id'])}
+current = home_points_gdf['fdh_id'].map(fdh_position).fillna(-1).to_numpy(dtype=int)
+
+# Only homes with a drop point in the graph and a known FDH can be reassigned
+routable = (home_idx >= 0) & (current >= 0)
+if (fdh_idx < 0).any():
+    print(f"{(fdh_idx < 0).sum()} FDH nodes are not in the graph and will not receive new homes.")
+    routable &= fdh_idx[np.maximum(current, 0)] >= 0
+fdh_in_graph = np.flatnonzero(fdh_idx >= 0)
+
+costs, fdhs = nearest_fdhs(graph, fdh_idx[fdh_in_graph], home_idx[routable], min(K_NEAREST, len(fdh_in_graph)))
+fdhs = np.where(fdhs >= 0, fdh_in_graph[np.maximum(fdhs, 0)], -1)
+
+# Ports taken by homes that cannot be reassigned are not available; an FDH that is already
+# over capacity keeps its current load so the problem stays feasible
+fixed_load = np.bincount(current[~routable & (current >= 0)], minlength=len(fdh_gdf))
+current_load = np.bincount(current[routable], minlength=len(fdh_gdf))
+capacity = np.maximum(MAX_HOMES_PER_FDH - fixed_load, current_load)
+assigned = assign_homes(costs, fdhs, current[routable], capacity, len(fdh_gdf))
+
+moved = (assigned != current[routable]).sum()
+new_fdh_id = home_points_gdf['fdh_id'].to_numpy().copy()
+new_fdh_id[routable] = fdh_gdf['id'].to_numpy()[assigned]
+home_points_gdf['fdh_id'] = new_fdh_id
+
+home_points_gdf.to_file('home_points.shp')
+print(f"{moved} of {routable.sum()} homes were reassigned. Updated home_points.shp.")
@@ -2,73 +2,99 @@
 
 import numpy as np
 import geopandas as gpd
+import pandas as pd
+import shapely
 from scipy.cluster.hierarchy import fcluster, linkage
-from shapely.geometry import Point
-from shapely.ops import nearest_points
-
-def exclude_outliers(data):
-    """Exclude outliers using the IQR method."""
-    if len(data) == 0:
-        return np.array([], dtype=bool)
-    Q1 = np.percentile(data, 25, axis=0)
-    Q3 = np.percentile(data, 75, axis=0)
+
+# Ward linkage needs an O(n^2) distance matrix, so larger projects fall back to bisection
+WARD_MAX_HOMES = 15000
+
+def find_median_centers(coordinates, clusters):
+    """Find the median center of every cluster, excluding outliers using the IQR method.
+
+    Quartiles and medians come from one groupby over all homes instead of a mask per
+    cluster. Returns the sorted cluster ids and an (n_clusters, 2) array of centers.
+    """
+    points = pd.DataFrame(coordinates, columns=['x', 'y'])
+    points['cluster'] = clusters
+    grouped = points.groupby('cluster')[['x', 'y']]
+    Q1 = grouped.quantile(0.25).loc[clusters].to_numpy()
+    Q3 = grouped.quantile(0.75).loc[clusters].to_numpy()
     IQR = Q3 - Q1
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-    # Returns a boolean mask where True indicates the points that are not outliers
-    return (data >= lower_bound) & (data <= upper_bound)
-
-def find_median_center(cluster_points):
-    """Find the median center of a cluster, excluding outliers."""
-    if len(cluster_points) == 0:
-        return None, None
-    outlier_mask = exclude_outliers(cluster_points)
-    # Apply mask to filter both dimensions
-    filtered_points = cluster_points[np.all(outlier_mask, axis=1)]
-    median_x = np.median(filtered_points[:, 0])
-    median_y = np.median(filtered_points[:, 1])
-    return median_x, median_y
-
-def snap_to_road(median_center, roads):
-    """Snap median center to the closest point on the closest road line."""
-    closest_road = roads.geometry.unary_union
-    closest_point = nearest_points(median_center, closest_road)[1]
-    return closest_point
-
-def cluster_homes_and_save(shapefile_path, road_centerlines_path='road_centerlines.shp', home_points_path='home_points_fdh.shp', fdh_path='fdh.shp', max_homes_per_cluster=432):
+    not_outlier = np.all((coordinates >= Q1 - 1.5 * IQR) & (coordinates <= Q3 + 1.5 * IQR), axis=1)
+    # Fall back to the plain median for a cluster whose every point is an outlier on some axis
+    all_medians = grouped.median()
+    centers = points[not_outlier].groupby('cluster')[['x', 'y']].median().reindex(all_medians.index).fillna(all_medians)
+    return centers.index.to_numpy(), centers.to_numpy()
+
+def bisect_clusters(coordinates, max_homes_per_cluster):
+    """Cluster points by recursive spatial bisection.
+
+    Each group is cut across its longer side so that both halves need a whole number of
+    clusters, which yields ceil(n / max_homes_per_cluster) clusters, none over capacity.
+    Runs in O(n log n) time and O(n) memory, unlike Ward linkage. Labels start at 1.
+    """
+    clusters = np.zeros(len(coordinates), dtype=int)
+    next_label = 1
+    stack = [np.arange(len(coordinates))]
+    while stack:
+        indices = stack.pop()
+        n_clusters = -(-len(indices) // max_homes_per_cluster)
+        if n_clusters <= 1:
+            clusters[indices] = next_label
+            next_label += 1
+            continue
+        points = coordinates[indices]
+        axis = np.argmax(points.max(axis=0) - points.min(axis=0))
+        split = round(len(indices) * (n_clusters // 2) / n_clusters)
+        order = np.argpartition(points[:, axis], split)
+        stack.append(indices[order[split:]])
+        stack.append(indices[order[:split]])
+    return clusters
+
+def snap_to_roads(median_centers, roads):
+    """Snap every median center to the closest point on the closest road line.
+
+    The nearest road of each center comes from one batched query of the roads' STRtree.
+    """
+    points = shapely.points(median_centers)
+    center_idx, road_idx = roads.sindex.nearest(points, return_all=False)
+    snapped = shapely.shortest_line(points[center_idx], roads.geometry.values[road_idx])
+    return shapely.get_point(snapped, 1)
+
+def cluster_homes_and_save(shapefile_path, road_centerlines_path='road_centerlines.shp', home_points_path='home_points_fdh.shp', fdh_path='fdh.shp', max_homes_per_cluster=432, method='auto'):
     homes = gpd.read_file(shapefile_path)
     roads = gpd.read_file(road_centerlines_path)
-    coordinates = np.array(list(homes.geometry.apply(lambda x: (x.x, x.y))))
-    Z = linkage(coordinates, method='ward')
-
-    # Attempt to find an appropriate distance threshold dynamically
-    max_distance = Z[-1, 2]  # Maximum distance in the linkage matrix
-    distance_threshold = max_distance / 2  # Start with half of the maximum distance
-    clusters = fcluster(Z, t=distance_threshold, criterion='distance')
-    while np.max(np.bincount(clusters)) > max_homes_per_cluster and distance_threshold > 0:
-        distance_threshold *= 0.95  # Gradually decrease the threshold
+    coordinates = np.column_stack((homes.geometry.x.values, homes.geometry.y.values))
+    if method == 'auto':
+        method = 'ward' if len(coordinates) <= WARD_MAX_HOMES else 'bisect'
+
+    if method == 'bisect':
+        clusters = bisect_clusters(coordinates, max_homes_per_cluster)
+    else:
+        Z = linkage(coordinates, method='ward')
+
+        # Attempt to find an appropriate distance threshold dynamically
+        max_distance = Z[-1, 2]  # Maximum distance in the linkage matrix
+        distance_threshold = max_distance / 2  # Start with half of the maximum distance
         clusters = fcluster(Z, t=distance_threshold, criterion='distance')
-    
-    if distance_threshold <= 0:
-        print("Unable to find a suitable distance threshold to meet the cluster size constraint.")
-        return
+        while np.max(np.bincount(clusters)) > max_homes_per_cluster and distance_threshold > 0:
+            distance_threshold *= 0.95  # Gradually decrease the threshold
+            clusters = fcluster(Z, t=distance_threshold, criterion='distance')
+
+        if distance_threshold <= 0:
+            print("Unable to find a suitable distance threshold to meet the cluster size constraint.")
+            return
 
     homes['fdh_id'] = clusters
     homes.to_file(home_points_path, driver='ESRI Shapefile')
     print(f"Clustered homes saved to {home_points_path}")
 
     # Calculate and save median centers
-    median_centers = []
-    for cluster_id in np.unique(homes['fdh_id']):
-        cluster_points = np.array(list(homes.loc[homes['fdh_id'] == cluster_id, 'geometry'].apply(lambda p: (p.x, p.y))))
-        median_x, median_y = find_median_center(cluster_points)
-        if median_x is not None and median_y is not None:
-            median_center = Point(median_x, median_y)
-            snapped_center = snap_to_road(median_center, roads)
-            median_centers.append({'geometry': snapped_center, 'id': cluster_id})
-
-    median_centers_gdf = gpd.GeoDataFrame(median_centers, geometry='geometry')
-    median_centers_gdf.crs = homes.crs
+    cluster_ids, centers = find_median_centers(coordinates, clusters)
+    snapped_centers = snap_to_roads(centers, roads)
+
+    median_centers_gdf = gpd.GeoDataFrame({'id': cluster_ids}, geometry=snapped_centers, crs=homes.crs)
     median_centers_gdf.to_file(fdh_path, driver='ESRI Shapefile')
     print(f"Median centers saved to {fdh_path}")
 
@@ -2,79 +2,201 @@
 
 import numpy as np
 import geopandas as gpd
+import pandas as pd
 from scipy.cluster.hierarchy import fcluster, linkage
-from shapely.geometry import Point
-from shapely.ops import nearest_points
-
-def exclude_outliers(data):
-    """Exclude outliers using the IQR method."""
-    if len(data) == 0:
-        return np.array([], dtype=bool)
-    Q1 = np.percentile(data, 25, axis=0)
-    Q3 = np.percentile(data, 75, axis=0)
+from scipy.spatial import cKDTree
+from routing import CompiledGraph
+
+# Ward linkage needs an O(n^2) distance matrix, so larger projects fall back to bisection
+WARD_MAX_HOMES = 15000
+
+def find_median_centers(coordinates, clusters):
+    """Find the median center of every cluster, excluding outliers using the IQR method.
+
+    Quartiles and medians come from one groupby over all homes instead of a mask per
+    cluster. Returns the sorted cluster ids and an (n_clusters, 2) array of centers.
+    """
+    points = pd.DataFrame(coordinates, columns=['x', 'y'])
+    points['cluster'] = clusters
+    grouped = points.groupby('cluster')[['x', 'y']]
+    Q1 = grouped.quantile(0.25).loc[clusters].to_numpy()
+    Q3 = grouped.quantile(0.75).loc[clusters].to_numpy()
     IQR = Q3 - Q1
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-    return (data >= lower_bound) & (data <= upper_bound)
-
-def find_median_center(cluster_points):
-    """Find the median center of a cluster, excluding outliers."""
-    if len(cluster_points) == 0:
-        return None, None
-    outlier_mask = exclude_outliers(cluster_points)
-    filtered_points = cluster_points[np.all(outlier_mask, axis=1)]
-    median_x = np.median(filtered_points[:, 0])
-    median_y = np.median(filtered_points[:, 1])
-    return median_x, median_y
-
-def snap_to_nearest_node(median_center, nodes):
-    """Snap median center to the closest node where 'type' does not equal 'HP'."""
-    # Filter nodes to exclude those with type 'HP'
+    not_outlier = np.all((coordinates >= Q1 - 1.5 * IQR) & (coordinates <= Q3 + 1.5 * IQR), axis=1)
+    # Fall back to the plain median for a cluster whose every point is an outlier on some axis
+    all_medians = grouped.median()
+    centers = points[not_outlier].groupby('cluster')[['x', 'y']].median().reindex(all_medians.index).fillna(all_medians)
+    return centers.index.to_numpy(), centers.to_numpy()
+
+def bisect_clusters(coordinates, max_homes_per_cluster):
+    """Cluster points by recursive spatial bisection.
+
+    Each group is cut across its longer side so that both halves need a whole number of
+    clusters, which yields ceil(n / max_homes_per_cluster) clusters, none over capacity.
+    Runs in O(n log n) time and O(n) memory, unlike Ward linkage. Labels start at 1.
+    """
+    clusters = np.zeros(len(coordinates), dtype=int)
+    next_label = 1
+    stack = [np.arange(len(coordinates))]
+    while stack:
+        indices = stack.pop()
+        n_clusters = -(-len(indices) // max_homes_per_cluster)
+        if n_clusters <= 1:
+            clusters[indices] = next_label
+            next_label += 1
+            continue
+        points = coordinates[indices]
+        axis = np.argmax(points.max(axis=0) - points.min(axis=0))
+        split = round(len(indices) * (n_clusters // 2) / n_clusters)
+        order = np.argpartition(points[:, axis], split)
+        stack.append(indices[order[split:]])
+        stack.append(indices[order[:split]])
+    return clusters
+
+def find_distance_threshold(Z, max_homes_per_cluster, return_counts=False):
+    """Find the highest cut of linkage matrix Z where no cluster exceeds max_homes_per_cluster.
+
+    Merges are walked once in height order; Z[:, 3] already holds the size of the cluster
+    each merge creates, so a running maximum gives the largest cluster at every cut. Returns
+    None if even the lowest cut is over capacity. With return_counts=True, also returns a
+    DataFrame of cluster count and largest cluster size for every distinct merge height.
+    """
+    order = np.argsort(Z[:, 2], kind='stable')
+    heights = Z[order, 2]
+    largest = np.maximum.accumulate(Z[order, 3])
+    n_clusters = len(Z) - np.arange(len(Z))
+
+    # A cut at height h applies every merge with height <= h, so only the last merge of a tie counts
+    last_of_height = np.append(heights[1:] != heights[:-1], True)
+    heights, largest, n_clusters = heights[last_of_height], largest[last_of_height], n_clusters[last_of_height]
+
+    feasible = np.flatnonzero(largest <= max_homes_per_cluster)
+    if len(feasible) > 0:
+        distance_threshold = heights[feasible[-1]]
+    elif heights[0] > 0:
+        distance_threshold = 0.0  # Every home in its own cluster
+    else:
+        distance_threshold = None
+
+    if return_counts:
+        counts = pd.DataFrame({'threshold': heights, 'clusters': n_clusters, 'max_size': largest.astype(int)})
+        return distance_threshold, counts
+    return distance_threshold
+
+def snap_to_nearest_nodes(median_centers, nodes):
+    """Snap every median center to the closest node where 'type' does not equal 'HP'.
+
+    The eligible nodes are put in a KD-tree once and all centers are queried in one batch.
+    """
     eligible_nodes = nodes[nodes['type'] != 'HP']
-    # Find the nearest eligible node
-    closest_node = eligible_nodes.geometry.unary_union
-    closest_point = nearest_points(median_center, closest_node)[1]
-    # Get the ID of the closest node
-    closest_node_id = eligible_nodes.loc[eligible_nodes.geometry == closest_point, 'id'].values[0]
-    return closest_point, closest_node_id
-
-def cluster_homes_and_save(shapefile_path, nodes_path='nodes.shp', home_points_path='home_points.shp', fdh_path='fdh.shp', max_homes_per_cluster=432):
+    node_coords = np.column_stack((eligible_nodes.geometry.x.values, eligible_nodes.geometry.y.values))
+    _, nearest = cKDTree(node_coords).query(median_centers, k=1)
+    return eligible_nodes.geometry.values[nearest], eligible_nodes['id'].values[nearest]
+
+def place_fdhs_by_network_cost(clusters, cluster_ids, home_nodes, initial_node_ids, nodes, edges, n_candidates=32, max_iterations=20):
+    """Move each FDH to the eligible node with the least total routed cost to its homes.
+
+    Every FDH is compared with the n_candidates eligible nodes nearest to it and moves to
+    the one reaching the most of its homes, then the cheapest to reach them; this repeats around the new location until no FDH moves (vertex
+    substitution, as in Teitz-Bart). Candidate costs come from batched csgraph.dijkstra
+    calls limited to 1.5x the farthest home already served. Home assignments do not change,
+    and homes no chosen node can reach are reported. Returns the chosen node ids.
+    """
+    graph = CompiledGraph(edges, terminal_nodes=nodes.loc[nodes['type'] == 'HP', 'id'])
+    eligible_nodes = nodes[(nodes['type'] != 'HP') & nodes['id'].isin(graph.node_ids)]
+    eligible_idx = graph.index_of(eligible_nodes['id'])
+    eligible_coords = np.column_stack((eligible_nodes.geometry.x.values, eligible_nodes.geometry.y.values))
+    tree = cKDTree(eligible_coords)
+    position = pd.Series(np.arange(len(eligible_idx)), index=eligible_idx)
+
+    # Graph indices of the drop points served by each FDH
+    home_idx = graph.index_of(home_nodes)
+    cluster_pos = np.searchsorted(cluster_ids, clusters)[home_idx >= 0]
+    home_idx = home_idx[home_idx >= 0]
+    order = np.argsort(cluster_pos, kind='stable')
+    homes_of = np.split(home_idx[order], np.cumsum(np.bincount(cluster_pos, minlength=len(cluster_ids)))[:-1])
+
+    def routed_costs(pairs, limit):
+        """Homes reached from each (cluster, eligible position) pair, with their total and worst routed cost."""
+        pairs_of_source = {}
+        for i, (_, pos) in enumerate(pairs):
+            pairs_of_source.setdefault(eligible_idx[pos], []).append(i)
+        reached, totals, worst = np.empty(len(pairs), dtype=int), np.empty(len(pairs)), np.empty(len(pairs))
+        for batch, dist in graph.distances(list(pairs_of_source), limit=limit):
+            for k, source in enumerate(batch):
+                for i in pairs_of_source[source]:
+                    home_costs = dist[k][homes_of[pairs[i][0]]]
+                    home_costs = home_costs[np.isfinite(home_costs)]
+                    reached[i], totals[i], worst[i] = len(home_costs), home_costs.sum(), home_costs.max(initial=0)
+        return reached, totals, worst
+
+    current = position.loc[graph.index_of(initial_node_ids)].to_numpy()
+    current_reached, current_cost, worst = routed_costs(list(enumerate(current)), np.inf)
+    # A candidate needing more than this to reach one of its homes is not worth finding
+    limit = 1.5 * worst.max(initial=0) or np.inf
+    active = np.arange(len(cluster_ids))
+
+    for iteration in range(max_iterations):
+        _, candidates = tree.query(eligible_coords[current[active]], k=min(n_candidates, len(eligible_idx)))
+        candidates = candidates.reshape(len(active), -1)
+        pairs = [(c, pos) for c, row in zip(active, candidates) for pos in row]
+        reached, costs, _ = routed_costs(pairs, limit)
+        reached, costs = reached.reshape(len(active), -1), costs.reshape(len(active), -1)
+        # Reaching more homes comes first, so one unreachable home cannot pin an FDH in place
+        best = np.argmin(np.where(reached == reached.max(axis=1, keepdims=True), costs, np.inf), axis=1)
+        best_reached = reached[np.arange(len(active)), best]
+        best_cost = costs[np.arange(len(active)), best]
+        moved = (best_reached > current_reached[active]) | ((best_reached == current_reached[active]) & (best_cost < current_cost[active] - 1e-9))
+        current[active[moved]] = candidates[moved, best[moved]]
+        current_reached[active[moved]] = best_reached[moved]
+        current_cost[active[moved]] = best_cost[moved]
+        print(f"Siting iteration {iteration + 1}: {moved.sum()} FDHs moved, total cost {current_cost.sum():,.0f}")
+        active = active[moved]
+        if len(active) == 0:
+            break
+
+    for cluster_id, homes, n_reached in zip(cluster_ids, homes_of, current_reached):
+        if n_reached < len(homes):
+            print(f"FDH {cluster_id}: {len(homes) - n_reached} of its {len(homes)} homes cannot be reached from its node.")
+
+    return eligible_nodes['id'].values[current], eligible_nodes.geometry.values[current]
+
+def cluster_homes_and_save(shapefile_path, nodes_path='nodes.shp', home_points_path='home_points.shp', fdh_path='fdh.shp', max_homes_per_cluster=432, method='auto', siting='median', edges_path='edges.shp'):
     homes = gpd.read_file(shapefile_path)
     nodes = gpd.read_file(nodes_path)
-    coordinates = np.array(list(homes.geometry.apply(lambda x: (x.x, x.y))))
-    Z = linkage(coordinates, method='ward')
-
-    max_distance = Z[-1, 2]
-    distance_threshold = max_distance / 2
-    clusters = fcluster(Z, t=distance_threshold, criterion='distance')
-    while np.max(np.bincount(clusters)) > max_homes_per_cluster and distance_threshold > 0:
-        distance_threshold *= 0.95
+    coordinates = np.column_stack((homes.geometry.x.values, homes.geometry.y.values))
+    if method == 'auto':
+        method = 'ward' if len(coordinates) <= WARD_MAX_HOMES else 'bisect'
+
+    if method == 'bisect':
+        clusters = bisect_clusters(coordinates, max_homes_per_cluster)
+    else:
+        Z = linkage(coordinates, method='ward')
+        distance_threshold = find_distance_threshold(Z, max_homes_per_cluster)
+        if distance_threshold is None:
+            print("Unable to find a suitable distance threshold to meet the cluster size constraint.")
+            return
         clusters = fcluster(Z, t=distance_threshold, criterion='distance')
-    
-    if distance_threshold <= 0:
-        print("Unable to find a suitable distance threshold to meet the cluster size constraint.")
-        return
 
+    save_clusters(homes, nodes, coordinates, clusters, home_points_path, fdh_path, siting, edges_path)
+
+def save_clusters(homes, nodes, coordinates, clusters, home_points_path='home_points.shp', fdh_path='fdh.shp', siting='median', edges_path='edges.shp'):
+    """Write homes with their fdh_id and place one FDH per cluster."""
+    homes = homes.copy()
     homes['fdh_id'] = clusters
     homes.to_file(home_points_path, driver='ESRI Shapefile')
     print(f"Clustered homes saved to {home_points_path}")
 
-    median_centers = []
-    for cluster_id in np.unique(homes['fdh_id']):
-        cluster_points = np.array(list(homes.loc[homes['fdh_id'] == cluster_id, 'geometry'].apply(lambda p: (p.x, p.y))))
-        median_x, median_y = find_median_center(cluster_points)
-        if median_x is not None and median_y is not None:
-            median_center = Point(median_x, median_y)
-            snapped_center, node_id = snap_to_nearest_node(median_center, nodes)
-            median_centers.append({
-                'geometry': snapped_center,
-                'id': cluster_id,
-                'node_id': node_id
-            })
-
-    median_centers_gdf = gpd.GeoDataFrame(median_centers, columns=['geometry', 'id', 'node_id'], crs=homes.crs)
+    cluster_ids, centers = find_median_centers(coordinates, clusters)
+    snapped_centers, node_ids = snap_to_nearest_nodes(centers, nodes)
+    if siting == 'network':
+        edges = gpd.read_file(edges_path)
+        node_ids, snapped_centers = place_fdhs_by_network_cost(clusters, cluster_ids, homes['drop_point'].to_numpy(), node_ids, nodes, edges)
+
+    median_centers_gdf = gpd.GeoDataFrame({'id': cluster_ids, 'node_id': node_ids}, geometry=snapped_centers, crs=homes.crs)
     median_centers_gdf.to_file(fdh_path, driver='ESRI Shapefile')
     print(f"Median centers saved to {fdh_path}")
 
-# Adjust the call to cluster_homes_and_save as needed
-cluster_homes_and_save('home_points.shp')
+if __name__ == '__main__':
+    # Adjust the call to cluster_homes_and_save as needed
+    cluster_homes_and_save('home_points.shp')
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+from scipy.spatial import cKDTree
+from routing import build_graph, downstream_totals, route_fdh_tree, steiner_tree
+
+# Feeder layout: 'steiner' grows one Takahashi-Matsuyama tree from the headend so FDHs share
+# trunk wherever it is cheaper overall, 'tree' takes each FDH's shortest path from the headend
+FEEDER_ROUTING = 'steiner'
+OUTPUT_PATH = 'feeder.shp'
+
+def find_headend_node(headend_gdf, nodes_gdf):
+    """Return the node_id of the headend, or the closest node where 'type' does not equal 'HP'."""
+    if 'node_id' in headend_gdf.columns and headend_gdf['node_id'].notna().any():
+        return headend_gdf['node_id'].dropna().iloc[0]
+    eligible_nodes = nodes_gdf[nodes_gdf['type'] != 'HP']
+    node_coords = np.column_stack((eligible_nodes.geometry.x.values, eligible_nodes.geometry.y.values))
+    headend_point = headend_gdf.geometry.iloc[0]
+    _, nearest = cKDTree(node_coords).query((headend_point.x, headend_point.y), k=1)
+    return eligible_nodes['id'].iloc[nearest]
+
+if not os.path.exists('headend.shp'):
+    print("headend.shp not found, skipping the feeder design.")
+    sys.exit(0)
+
+print("Building the graph...")
+
+# Load shapefiles
+edges_gdf = gpd.read_file('edges.shp')
+nodes_gdf = gpd.read_file('nodes.shp')
+home_points_gdf = gpd.read_file('home_points.shp')
+fdh_gdf = gpd.read_file('fdh.shp')
+headend_gdf = gpd.read_file('headend.shp').to_crs(edges_gdf.crs)
+
+# Build the graph; drops end at a home, so the feeder never runs through one
+G = build_graph(edges_gdf)
+nx.set_node_attributes(G, dict.fromkeys(home_points_gdf['drop_point'].dropna(), True), 'terminal')
+
+headend_node = find_headend_node(headend_gdf, nodes_gdf)
+fdh_to_node = fdh_gdf.set_index('id')['node_id'].to_dict()
+fdh_nodes = list(dict.fromkeys(fdh_to_node.values()))
+
+print(f"Routing the feeder from headend node {headend_node} to {len(fdh_nodes)} FDHs...")
+
+# One search from the headend reaches every FDH, either as a Steiner tree or a shortest-path tree
+if FEEDER_ROUTING == 'steiner':
+    routes = steiner_tree(G, headend_node, fdh_nodes, weight='cost')
+else:
+    routes = route_fdh_tree(G, headend_node, fdh_nodes, weight='cost')
+
+# Both run from the FDH towards the headend, so each node's parent is the next one
+parent = {}
+for fdh_node, path in routes:
+    if path is None:
+        print(f"No path found from FDH node {fdh_node} to headend node {headend_node}.")
+        continue
+    for u, v in zip(path[:-1], path[1:]):
+        parent[u] = v
+
+# Shared-trunk accounting: the FDHs and homes fed through every feeder edge
+fdh_counts = fdh_gdf['node_id'].value_counts().to_dict()
+home_counts = home_points_gdf['fdh_id'].map(fdh_to_node).value_counts().to_dict()
+fdhs = downstream_totals(parent, fdh_counts)
+homes = downstream_totals(parent, home_counts)
+
+feeder_edges = list(parent.items())
+feeder_gdf = edges_gdf.loc[[G[u][v]['row'] for u, v in feeder_edges], ['geometry', 'type', 'length', 'cost']].reset_index(drop=True)
+feeder_gdf['fdhs'] = [fdhs[u] for u, _ in feeder_edges]
+feeder_gdf['homes'] = [homes[u] for u, _ in feeder_edges]
+feeder_gdf.to_file(OUTPUT_PATH)
+
+# Footage laid once, against the footage of a separate feeder run to every FDH
+feeder_feet = feeder_gdf.geometry.length
+print(f"Feeder footage: {feeder_feet.sum():.0f} ft, {(feeder_feet * feeder_gdf['fdhs']).sum():.0f} ft if no trunk were shared.")
+print(f"Saved {len(feeder_gdf)} feeder edges to {OUTPUT_PATH}.")
+print("Done.")
@@ -2,8 +2,7 @@
 
 import geopandas as gpd
 from scipy.spatial import KDTree
-from shapely.geometry import Point, LineString
-from shapely.ops import nearest_points
+import shapely
 import numpy as np
 
 # Load home points from a shapefile
@@ -49,29 +48,27 @@ for i, coord in enumerate(coords):
     clusters.append(indices)
     is_clustered[indices] = True
 
-# Function to snap point to nearest line
-def snap_to_nearest_line(point, lines_gdf):
-    nearest_line = None
-    min_distance = float('inf')
-
-    for line in lines_gdf.geometry:
-        if line.distance(point) < min_distance:
-            nearest_line = line
-            min_distance = line.distance(point)
-
-    nearest_point_on_line = nearest_points(point, nearest_line)[1]
-    return nearest_point_on_line
-
-# Calculate the centroids for each cluster and snap to nearest line
-cluster_centroids = []
-for cluster_indices in clusters:
-    cluster_coords = coords[cluster_indices]
-    centroid = Point(np.mean(cluster_coords[:, 0]), np.mean(cluster_coords[:, 1]))
-    snapped_point = snap_to_nearest_line(centroid, network_gdf)
-    cluster_centroids.append({'geometry': snapped_point})
+# Function to snap points to their nearest lines
+def snap_to_nearest_lines(points, lines_gdf):
+    """Snap every point to the closest point on its nearest line.
+
+    All points are matched in one STRtree query. Of lines equally near a point, the first
+    in lines_gdf is used, as a scan of the lines in order would.
+    """
+    lines = lines_gdf.geometry.to_numpy()
+    point_idx, line_idx = shapely.STRtree(lines).query_nearest(points, all_matches=True)
+    order = np.lexsort((line_idx, point_idx))
+    point_idx, line_idx = point_idx[order], line_idx[order]
+    first = np.ones(len(point_idx), dtype=bool)
+    first[1:] = point_idx[1:] != point_idx[:-1]
+    return shapely.get_point(shapely.shortest_line(points, lines[line_idx[first]]), 1)
+
+# Calculate the centroids for each cluster and snap them all to the nearest lines at once
+centroids = shapely.points([(np.mean(coords[cluster_indices, 0]), np.mean(coords[cluster_indices, 1])) for cluster_indices in clusters])
+snapped_points = snap_to_nearest_lines(centroids, network_gdf)
 
 # Create a GeoDataFrame for cluster centroids
-clusters_gdf = gpd.GeoDataFrame(cluster_centroids, crs=home_points_gdf.crs)
+clusters_gdf = gpd.GeoDataFrame(geometry=snapped_points, crs=home_points_gdf.crs)
 
 # Save the cluster centroids to mst.shp
 clusters_gdf.to_file('mst.shp')
@@ -3,6 +3,7 @@
 import geopandas as gpd
 import networkx as nx
 import time
+from routing import build_graph, route_fdh_tree
 
 print("Building the graph...")
 
@@ -12,13 +13,14 @@ nodes_gdf = gpd.read_file('nodes.shp')
 home_points_gdf = gpd.read_file('home_points.shp')
 
 # Build the graph
-G = nx.Graph()
-for _, edge in edges_gdf.iterrows():
-    G.add_edge(edge['start_node'], edge['end_node'], weight=edge['cost'], type=edge['type'], length=edge['length'], cost=edge['cost'])
+G = build_graph(edges_gdf)
 
 # Identify home nodes
 home_nodes = set(home_points_gdf['drop_point'].dropna())
 
+# Mark home nodes as terminal so routes may end at them but never pass through them
+nx.set_node_attributes(G, dict.fromkeys(home_nodes, True), 'terminal')
+
 # Create a new graph that only contains the home nodes
 home_graph = nx.Graph()
 
@@ -27,33 +29,14 @@ counter = 0
 
 target_node = '202'
 
-# Store the edges connected to home nodes
-home_node_edges = {}
-for node in home_nodes:
-    home_node_edges[node] = list(G.edges(node, data=True))
-
-# Remove all home nodes from the graph
-G_temp = G.copy()
-G_temp.remove_nodes_from(home_nodes)
-
 # Start the timer
 start_time = time.time()
 
-# Find the minimum cost path from each home node to the target node
-for start_node in home_nodes:
-    # Add the current start node back to the graph along with its edges
-    G_temp.add_node(start_node)
-    G_temp.add_edges_from(home_node_edges[start_node])
-
-    try:
-        path = nx.shortest_path(G_temp, start_node, target_node, weight='cost')
+# Find the minimum cost path from each home node to the target node, all from one shortest-path tree
+for start_node, path in route_fdh_tree(G, target_node, home_nodes, weight='cost'):
+    if path is not None:
         for i in range(len(path) - 1):
-            home_graph.add_edge(path[i], path[i+1])
-    except nx.NetworkXNoPath:
-        pass
-    finally:
-        # Remove the start node again
-        G_temp.remove_node(start_node)
+            home_graph.add_edge(path[i], path[i+1], row=G[path[i]][path[i+1]]['row'])
 
     counter += 1
     print(f'Progress: {counter}/{total}', end='\r')
@@ -63,16 +46,7 @@ end_time = time.time()
 elapsed_time = end_time - start_time
 print(f"\nDone in {elapsed_time:.2f} seconds.")
 
-# Create a GeoDataFrame for the network
-network_data = []
-
-# Iterate over the edges in the home_graph and use edge geometry from edges.shp
-for edge in home_graph.edges():
-    start_node, end_node = edge
-    edge_data = edges_gdf[((edges_gdf['start_node'] == start_node) & (edges_gdf['end_node'] == end_node)) | ((edges_gdf['start_node'] == end_node) & (edges_gdf['end_node'] == start_node))]
-    if not edge_data.empty:
-        edge_geom = edge_data.iloc[0]['geometry']
-        network_data.append({'geometry': edge_geom, 'type': edge_data.iloc[0]['type'], 'length': edge_data.iloc[0]['length'], 'cost': edge_data.iloc[0]['cost']})
-
-network_gdf = gpd.GeoDataFrame(network_data, crs=edges_gdf.crs)
+# Take the edges.shp row behind every edge in the home_graph
+rows = [edge_attrs['row'] for _, _, edge_attrs in home_graph.edges(data=True)]
+network_gdf = edges_gdf.loc[rows, ['geometry', 'type', 'length', 'cost']].reset_index(drop=True)
 network_gdf.to_file('network.shp')
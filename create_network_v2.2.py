@@ -2,8 +2,19 @@
 
 import geopandas as gpd
 import networkx as nx
+import numpy as np
 import time
-from shapely.geometry import box
+from routing import CompiledGraph, build_graph, route_fdhs
+
+# Routing backend: 'networkx', or 'csgraph' to batch all FDHs through scipy.sparse.csgraph
+ROUTING_BACKEND = 'networkx'
+# Worker processes for routing FDH groups in parallel; more than 1 implies 'csgraph'
+ROUTING_WORKERS = 1
+# Route over chains of degree-2 road nodes contracted into single edges; paths are expanded back
+CONTRACT_CHAINS = True
+# Route each FDH over only the edges within this many feet (> 0) of its homes (widened until all are
+# reached), or None to route every FDH over the whole graph
+FOOTPRINT_BUFFER = None
 
 # Load shapefiles
 edges_gdf = gpd.read_file('edges.shp')
@@ -14,9 +25,7 @@ fdh_gdf = gpd.read_file('fdh.shp')
 print("Grouping homes by FDH and sorting by distance to FDH...")
 
 # Build the graph
-G = nx.Graph()
-for _, edge in edges_gdf.iterrows():
-    G.add_edge(edge['start_node'], edge['end_node'], weight=edge['cost'], type=edge['type'], length=edge['length'], cost=edge['cost'])
+G = build_graph(edges_gdf)
 
 # Create a mapping from fdh_id to node_id for quick lookup
 fdh_to_node = fdh_gdf.set_index('id')['node_id'].to_dict()
@@ -24,10 +33,8 @@ fdh_to_node = fdh_gdf.set_index('id')['node_id'].to_dict()
 # Identify home nodes
 home_nodes = set(home_points_gdf['drop_point'].dropna())
 
-# Store the edges connected to home nodes for re-adding later
-home_node_edges = {}
-for node in home_nodes:
-    home_node_edges[node] = list(G.edges(node, data=True))
+# Mark home nodes as terminal so routes may end at them but never pass through them
+nx.set_node_attributes(G, dict.fromkeys(home_nodes, True), 'terminal')
 
 # Group home points by FDH
 fdh_to_homes = {}
@@ -37,35 +44,27 @@ for _, home_point in home_points_gdf.iterrows():
         fdh_to_homes[fdh_id] = []
     fdh_to_homes[fdh_id].append(home_point['drop_point'])
 
-# Before starting the sorting, ensure the graph is ready
-G_temp = G.copy()
-G_temp.remove_nodes_from(home_nodes)  # Initially remove all home nodes
-
-# Sort homes within each FDH group by proximity to FDH
-for fdh_id, homes in fdh_to_homes.items():
-    target_node = fdh_to_node.get(fdh_id)
-    if target_node:
-        homes_with_distance = []
-        for home in homes:
-            if home in home_node_edges:
-                # Temporarily add back the home node and its edges for distance calculation
-                G_temp.add_node(home)
-                G_temp.add_edges_from(home_node_edges[home])
-
-                try:
-                    # Calculate distance only if both nodes are present
-                    if G_temp.has_node(home) and G_temp.has_node(target_node):
-                        distance = nx.shortest_path_length(G_temp, source=home, target=target_node, weight='length')
-                        homes_with_distance.append((home, distance))
-                except nx.NetworkXNoPath:
-                    print(f"No path found from home node {home} to FDH node {target_node}.")
-                finally:
-                    # Remove the home node again to ensure it's not included in the next home's calculation
-                    G_temp.remove_node(home)
-
-        # Sort homes by calculated distance
-        homes_sorted = sorted(homes_with_distance, key=lambda x: x[1])
-        fdh_to_homes[fdh_id] = [home for home, _ in homes_sorted]  # Update with sorted homes
+# Sort homes within each FDH group by proximity to FDH. One Dijkstra by length from each FDH
+# node, with homes terminal, gives the distance to every one of its homes at once.
+length_graph = CompiledGraph(edges_gdf, weight='length', terminal_nodes=home_nodes)
+sort_fdhs = [fdh_id for fdh_id in fdh_to_homes if fdh_to_node.get(fdh_id)]
+fdh_idx = length_graph.index_of([fdh_to_node[fdh_id] for fdh_id in sort_fdhs])
+for fdh_id in np.array(sort_fdhs, dtype=object)[fdh_idx < 0]:
+    fdh_to_homes[fdh_id] = []  # No home can reach an FDH node that is not in the graph
+
+sort_fdhs = [fdh_id for fdh_id, idx in zip(sort_fdhs, fdh_idx) if idx >= 0]
+offset = 0
+for batch, dist in length_graph.distances(fdh_idx[fdh_idx >= 0]):
+    for fdh_id, fdh_dist in zip(sort_fdhs[offset:offset + len(batch)], dist):
+        homes = [home for home in fdh_to_homes[fdh_id] if G.has_node(home)]
+        distances = fdh_dist[length_graph.index_of(homes)]
+        for home in np.array(homes, dtype=object)[np.isinf(distances)]:
+            print(f"No path found from home node {home} to FDH node {fdh_to_node[fdh_id]}.")
+
+        # Routing reuses this order and skips the homes that cannot reach the FDH
+        order = np.argsort(distances, kind='stable')
+        fdh_to_homes[fdh_id] = [homes[i] for i in order if np.isfinite(distances[i])]  # Update with sorted homes
+    offset += len(batch)
 
 # Create a new graph to store paths
 home_graph = nx.Graph()
@@ -74,60 +73,25 @@ home_graph = nx.Graph()
 print("Building the network...")
 start_time = time.time()
 
-# Process each FDH group
-# Ensure nodes_gdf is indexed by node ID for efficient lookup
-nodes_gdf = nodes_gdf.set_index('id')
-nodes_sindex = nodes_gdf.sindex
-
+# Group the routable homes by FDH, keeping their sorted order
+fdh_homes = []
 for fdh_id, homes in fdh_to_homes.items():
-    print(f"Processing FDH {fdh_id} with {len(homes)} homes...")
     target_node = fdh_to_node.get(fdh_id)
     if not target_node:
+        continue  # Skip if FDH node is not in the graph
+    fdh_homes.append((fdh_id, target_node, [home for home in homes if home in G]))
+
+# Process each FDH group, routing all of its homes from one shortest-path tree
+processed_fdh = None
+for fdh_id, target_node, start_node, final_path in route_fdhs(G, edges_gdf, fdh_homes, ROUTING_BACKEND, workers=ROUTING_WORKERS, contract=CONTRACT_CHAINS, footprint=FOOTPRINT_BUFFER):
+    if fdh_id != processed_fdh:
+        print(f"Processing FDH {fdh_id} with {len(fdh_to_homes[fdh_id])} homes...")
+        processed_fdh = fdh_id
+    if final_path is None:
+        print(f"No path found from home node {start_node} to FDH node {target_node}.")
         continue
-
-    G_temp = G.copy()
-    G_temp.remove_nodes_from(home_nodes)  # Exclude home nodes
-
-    for start_node in homes:
-        if start_node in home_node_edges and start_node in nodes_gdf.index:
-            start_geom = nodes_gdf.loc[start_node, 'geometry']
-            
-            G_temp.add_node(start_node)
-            G_temp.add_edges_from(home_node_edges[start_node])
-
-            try:
-                path_to_fdh = nx.shortest_path(G_temp, start_node, target_node, weight='cost')
-                path_to_fdh_cost = sum(G_temp[path_to_fdh[i]][path_to_fdh[i+1]]['cost'] for i in range(len(path_to_fdh)-1))
-
-                alternate_path_cost = float('inf')
-                alternate_path = []
-
-                nearest_items = list(nodes_sindex.nearest(start_geom, 1))  # Using start_geom directly
-                if nearest_items:
-                    nearest_item_index = nearest_items[0]
-                    nearest_node_id = nodes_gdf.iloc[nearest_item_index].index  # Correctly access the index of the GeoDataFrame
-                    
-                    if nearest_node_id != start_node and nearest_node_id in G_temp:
-                        path = nx.shortest_path(G_temp, start_node, nearest_node_id, weight='cost')
-                        path_cost = sum(G_temp[path[i]][path[i+1]]['cost'] for i in range(len(path)-1))
-                        if path_cost < alternate_path_cost:
-                            alternate_path_cost = path_cost
-                            alternate_path = path
-                    else:
-                        print(f"Nearest node {nearest_node_id} is not a valid node in the graph.")
-                else:
-                    print(f"No nearest node found for home node {start_node}.")
-
-                final_path = path_to_fdh if path_to_fdh_cost <= alternate_path_cost else alternate_path
-
-                for i in range(len(final_path)-1):
-                    home_graph.add_edge(final_path[i], final_path[i+1], weight=G[final_path[i]][final_path[i+1]]['cost'], fdh_id=fdh_id)
-            
-            except nx.NetworkXNoPath:
-                print(f"No path found from home node {start_node} to FDH node {target_node}.")
-            finally:
-                G_temp.remove_node(start_node)
-
+    for i in range(len(final_path)-1):
+        home_graph.add_edge(final_path[i], final_path[i+1], weight=G[final_path[i]][final_path[i+1]]['cost'], row=G[final_path[i]][final_path[i+1]]['row'], fdh_id=fdh_id)
 
 # Stop the timer and print the elapsed time
 end_time = time.time()
@@ -136,32 +100,11 @@ print(f"\nNetwork complete in {elapsed_time:.2f} seconds.")
 
 print("Saving the network...")
 
-# Extract edges data from the home_graph to create a GeoDataFrame
-network_data = []
-
-edge_counter = 0
-total_edges = len(home_graph.edges(data=True))
-
-for edge in home_graph.edges(data=True):
-    start_node, end_node, edge_attrs = edge
-    edge_data = edges_gdf[((edges_gdf['start_node'] == start_node) & (edges_gdf['end_node'] == end_node)) |
-                           ((edges_gdf['start_node'] == end_node) & (edges_gdf['end_node'] == start_node))]
-    if not edge_data.empty:
-        fdh_id = edge_attrs['fdh_id']
-        edge_geom = edge_data.iloc[0]['geometry']
-        network_data.append({
-            'geometry': edge_geom,
-            'type': edge_data.iloc[0]['type'],
-            'length': edge_data.iloc[0]['length'],
-            'cost': edge_data.iloc[0]['cost'],
-            'fdh_id': fdh_id
-        })
-
-        # Update the progress indicator
-        edge_counter += 1
-        print(f'Processing edge {edge_counter}/{total_edges}', end='\r')
-
-network_gdf = gpd.GeoDataFrame(network_data, crs=edges_gdf.crs)
+# Every network edge carries the edges.shp row it was routed over, so the output is one take
+network_edges = list(home_graph.edges(data=True))
+network_gdf = edges_gdf.loc[[edge_attrs['row'] for _, _, edge_attrs in network_edges], ['geometry', 'type', 'length', 'cost']].reset_index(drop=True)
+network_gdf['fdh_id'] = [edge_attrs['fdh_id'] for _, _, edge_attrs in network_edges]
 network_gdf.to_file('network.shp')
 
-print("\nDone.")
\ No newline at end of file
+print(f"Saved {len(network_gdf)} network edges.")
+print("Done.")
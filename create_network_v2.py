@@ -1,8 +1,90 @@
 #!/usr/bin/env python3
 
+import os
+import pickle
 import geopandas as gpd
 import networkx as nx
+import numpy as np
 import time
+from routing import CompiledGraph, build_graph, downstream_totals, route_fdhs
+
+# Routing backend: 'networkx', or 'csgraph' to batch all FDHs through scipy.sparse.csgraph
+ROUTING_BACKEND = 'networkx'
+# Worker processes for routing FDH groups in parallel; more than 1 implies 'csgraph'
+ROUTING_WORKERS = 1
+# Route over chains of degree-2 road nodes contracted into single edges; paths are expanded back
+CONTRACT_CHAINS = True
+# Route each FDH over only the edges within this many feet (> 0) of its homes (widened until all are
+# reached), or None to route every FDH over the whole graph
+FOOTPRINT_BUFFER = None
+# Reuse the last run's trees and reroute only the FDHs that edits to edges.shp or the homes affect
+INCREMENTAL = True
+STATE_PATH = 'network_state.pkl'
+STATE_FORMAT = 3  # Trees are stored as child -> parent node mappings, with the homes left unreached
+# Fiber cable sizes, smallest first; each edge gets the smallest that carries its fibers plus spares
+CABLE_SIZES = [12, 24, 48, 72, 96, 144, 216, 288, 432]
+SPARE_FIBER = 0.2  # Spare fibers as a fraction of the homes (or units) served
+
+def edge_key(u, v):
+    return (u, v) if u <= v else (v, u)
+
+def find_affected_fdhs(previous, edge_costs, terminals, fdh_homes, edges_gdf):
+    """Return the ids of the FDHs whose trees may differ from the previous run.
+
+    An FDH is rerouted if it is new, if its node or homes changed, or if its tree uses an
+    edge that was removed or got more expensive, or passes a node that became terminal.
+    Edges that were added or got cheaper, or that touch a node which is no longer
+    terminal, can only shorten a route that reaches one of their ends. So an FDH is also
+    rerouted if the unrestricted distance to such an edge plus its cost is within the
+    FDH's previous radius, the cost of its farthest home. Such an edge may also connect a
+    home that had no path, so FDHs with unreached homes are always rerouted then.
+    """
+    old_costs = previous['edge_costs']
+    worse = {pair for pair, cost in old_costs.items() if edge_costs.get(pair, np.inf) > cost}
+    new_terminals = terminals - previous['terminals']
+    freed = previous['terminals'] - terminals
+    better = {pair: cost for pair, cost in edge_costs.items() if cost < old_costs.get(pair, np.inf) or pair[0] in freed or pair[1] in freed}
+
+    affected = set()
+    unchanged = []
+    for fdh_id, fdh_node, homes in fdh_homes:
+        old = previous['fdhs'].get(fdh_id)
+        if old is None or old['node'] != fdh_node or old['homes'] != tuple(homes):
+            affected.add(fdh_id)
+            continue
+        tree_nodes = set(old['tree']) | set(old['tree'].values())
+        if any(edge_key(u, v) in worse for u, v in old['tree'].items()) or (tree_nodes & new_terminals):
+            affected.add(fdh_id)
+            continue
+        if better and old['unreachable']:
+            affected.add(fdh_id)
+            continue
+        unchanged.append((fdh_id, fdh_node, old['radius']))
+
+    if better and unchanged:
+        graph = CompiledGraph(edges_gdf)
+        ends = graph.index_of([node for pair in better for node in pair])
+        end_costs = np.repeat(list(better.values()), 2)
+        found = ends >= 0
+        ends, end_costs = ends[found], end_costs[found]
+        fdh_idx = graph.index_of([fdh_node for _, fdh_node, _ in unchanged])
+        radius = np.array([r for _, _, r in unchanged])
+        # Cheapest route onto any improved edge and across it, for every unchanged FDH
+        reach = np.full(len(unchanged), np.inf)
+        offset = 0
+        for batch, dist in graph.distances(ends, limit=radius.max(initial=0)):
+            batch_costs = end_costs[offset:offset + len(batch), None]
+            offset += len(batch)
+            reach = np.minimum(reach, (dist[:, fdh_idx] + batch_costs).min(axis=0, initial=np.inf))
+        affected.update(fdh_id for (fdh_id, _, _), r, lb in zip(unchanged, radius, reach) if lb <= r)
+    return affected
+
+def cable_size(fibers):
+    """Return the smallest cable in CABLE_SIZES with at least fibers, or enough of the largest."""
+    for size in CABLE_SIZES:
+        if fibers <= size:
+            return size
+    return -(-fibers // CABLE_SIZES[-1]) * CABLE_SIZES[-1]
 
 print("Building the graph...")
 
@@ -13,9 +95,7 @@ home_points_gdf = gpd.read_file('home_points.shp')
 fdh_gdf = gpd.read_file('fdh.shp')
 
 # Build the graph
-G = nx.Graph()
-for _, edge in edges_gdf.iterrows():
-    G.add_edge(edge['start_node'], edge['end_node'], weight=edge['cost'], type=edge['type'], length=edge['length'], cost=edge['cost'])
+G = build_graph(edges_gdf)
 
 # Create a mapping from fdh_id to node_id for quick lookup
 fdh_to_node = fdh_gdf.set_index('id')['node_id'].to_dict()
@@ -23,10 +103,8 @@ fdh_to_node = fdh_gdf.set_index('id')['node_id'].to_dict()
 # Identify home nodes
 home_nodes = set(home_points_gdf['drop_point'].dropna())
 
-# Store the edges connected to home nodes for re-adding later
-home_node_edges = {}
-for node in home_nodes:
-    home_node_edges[node] = list(G.edges(node, data=True))
+# Mark home nodes as terminal so routes may end at them but never pass through them
+nx.set_node_attributes(G, dict.fromkeys(home_nodes, True), 'terminal')
 
 # Create a new graph to store paths
 home_graph = nx.Graph()
@@ -37,37 +115,77 @@ counter = 0
 # Start the timer
 start_time = time.time()
 
-# Temporary copy of G to modify for each pathfinding operation, excluding home nodes initially
-G_temp = G.copy()
-G_temp.remove_nodes_from(home_nodes)
-
-# Find the minimum cost path from each home node to its associated FDH node
-for _, home_point in home_points_gdf.iterrows():
-    start_node = home_point['drop_point']
-    fdh_id = home_point['fdh_id']
-    if fdh_id in fdh_to_node and start_node in home_node_edges:
-        target_node = fdh_to_node[fdh_id]  # Lookup the target_node using fdh_id
-        
-        # Temporarily add the start node and its edges back to G_temp for pathfinding
-        G_temp.add_node(start_node)
-        G_temp.add_edges_from(home_node_edges[start_node])
-        
-        try:
-            if G_temp.has_node(target_node):  # Ensure the target FDH node exists in the graph
-                path = nx.shortest_path(G_temp, start_node, target_node, weight='cost')
-                for i in range(len(path) - 1):
-                    #home_graph.add_edge(path[i], path[i+1], weight=G[path[i]][path[i+1]]['cost'])
-                    # Include fdh_id as an edge attribute
-                    home_graph.add_edge(path[i], path[i+1], weight=G[path[i]][path[i+1]]['cost'], fdh_id=fdh_id)
-        except nx.NetworkXNoPath:
-            print(f"No path found from home node {start_node} to FDH node {target_node}.")
-        finally:
-            # Remove the start node again to reset G_temp for the next iteration
-            G_temp.remove_node(start_node)
+# Group the routable homes by FDH
+fdh_homes = []
+for fdh_id, homes in home_points_gdf.groupby('fdh_id')['drop_point']:
+    if fdh_id not in fdh_to_node:
+        counter += len(homes)
+        continue
+    routable_homes = [home for home in homes if home in G]
+    counter += len(homes) - len(routable_homes)
+    fdh_homes.append((fdh_id, fdh_to_node[fdh_id], routable_homes))  # Lookup the target node using fdh_id
+
+# Load the trees of the last run and find the FDHs that have to be rerouted
+edge_costs = {edge_key(u, v): cost for u, v, cost in G.edges(data='cost')}
+previous_state = None
+if INCREMENTAL and os.path.exists(STATE_PATH):
+    with open(STATE_PATH, 'rb') as f:
+        previous_state = pickle.load(f)
+    if previous_state.get('format') != STATE_FORMAT:
+        previous_state = None
+if previous_state is None:
+    reroute = {fdh_id for fdh_id, _, _ in fdh_homes}
+else:
+    reroute = find_affected_fdhs(previous_state, edge_costs, home_nodes, fdh_homes, edges_gdf)
+    print(f"Rerouting {len(reroute)} of {len(fdh_homes)} FDHs affected by changes since the last run.")
+
+fdh_state = {}
+for fdh_id, fdh_node, homes in fdh_homes:
+    if fdh_id in reroute:
+        fdh_state[fdh_id] = {'node': fdh_node, 'homes': tuple(homes), 'radius': 0.0, 'tree': {}, 'unreachable': []}
+    else:
+        fdh_state[fdh_id] = previous_state['fdhs'][fdh_id]
+        counter += len(homes)
+        for home in fdh_state[fdh_id]['unreachable']:
+            print(f"No path found from home node {home} to FDH node {fdh_node}.")
+
+# Route all homes of each FDH from a single shortest-path tree grown at the FDH node
+for fdh_id, target_node, start_node, path in route_fdhs(G, edges_gdf, [entry for entry in fdh_homes if entry[0] in reroute], ROUTING_BACKEND, workers=ROUTING_WORKERS, contract=CONTRACT_CHAINS, footprint=FOOTPRINT_BUFFER):
+    if path is None:
+        print(f"No path found from home node {start_node} to FDH node {target_node}.")
+        fdh_state[fdh_id]['unreachable'].append(start_node)
+    else:
+        tree = fdh_state[fdh_id]
+        tree['radius'] = max(tree['radius'], sum(G[u][v]['cost'] for u, v in zip(path[:-1], path[1:])))
+        # The path runs from the home to the FDH, so each node's parent is the next one
+        for u, v in zip(path[:-1], path[1:]):
+            tree['tree'][u] = v
 
     counter += 1
     print(f'Progress: {counter}/{total}', end='\r')
 
+# Homes and units at each drop point, per FDH, for the downstream totals on every edge
+include_unit_count = 'unit_count' in home_points_gdf.columns
+drop_point_totals = home_points_gdf.assign(homes=1).groupby(['fdh_id', 'drop_point'])[['homes', 'unit_count'] if include_unit_count else ['homes']].sum()
+fdh_drop_points = {fdh_id: totals.droplevel(0) for fdh_id, totals in drop_point_totals.groupby(level=0)}
+
+# Build the network from every FDH's tree, including fdh_id and the homes it serves as edge attributes
+for fdh_id, _, _ in fdh_homes:
+    tree = fdh_state[fdh_id]['tree']
+    at_drop_point = fdh_drop_points.get(fdh_id)
+    homes = downstream_totals(tree, at_drop_point['homes'].to_dict() if at_drop_point is not None else {})
+    units = downstream_totals(tree, at_drop_point['unit_count'].to_dict()) if include_unit_count and at_drop_point is not None else homes
+    for u, v in tree.items():
+        if home_graph.has_edge(u, v):
+            # A span shared by several FDHs' trees carries the fibers of all of them
+            shared = home_graph[u][v]
+            shared.update(fdh_id=fdh_id, homes=shared['homes'] + homes[u], units=shared['units'] + units[u])
+        else:
+            home_graph.add_edge(u, v, weight=G[u][v]['cost'], row=G[u][v]['row'], fdh_id=fdh_id, homes=homes[u], units=units[u])
+
+with open(STATE_PATH, 'wb') as f:
+    pickle.dump({'format': STATE_FORMAT, 'edge_costs': edge_costs, 'terminals': home_nodes, 'fdhs': fdh_state}, f)
+
 # Stop the timer and print the elapsed time
 end_time = time.time()
 elapsed_time = end_time - start_time
@@ -75,32 +193,15 @@ print(f"\nGraph complete in {elapsed_time:.2f} seconds.")
 
 print("Saving the network...")
 
-# Extract edges data from the home_graph to create a GeoDataFrame
-network_data = []
-
-edge_counter = 0
-total_edges = len(home_graph.edges(data=True))
-
-for edge in home_graph.edges(data=True):
-    start_node, end_node, edge_attrs = edge
-    edge_data = edges_gdf[((edges_gdf['start_node'] == start_node) & (edges_gdf['end_node'] == end_node)) |
-                           ((edges_gdf['start_node'] == end_node) & (edges_gdf['end_node'] == start_node))]
-    if not edge_data.empty:
-        fdh_id = edge_attrs['fdh_id']
-        edge_geom = edge_data.iloc[0]['geometry']
-        network_data.append({
-            'geometry': edge_geom,
-            'type': edge_data.iloc[0]['type'],
-            'length': edge_data.iloc[0]['length'],
-            'cost': edge_data.iloc[0]['cost'],
-            'fdh_id': fdh_id
-        })
-
-        # Update the progress indicator
-        edge_counter += 1
-        print(f'Processing edge {edge_counter}/{total_edges}', end='\r')
-
-network_gdf = gpd.GeoDataFrame(network_data, crs=edges_gdf.crs)
+# Every network edge carries the edges.shp row it was routed over, so the output is one take
+network_edges = list(home_graph.edges(data=True))
+network_gdf = edges_gdf.loc[[edge_attrs['row'] for _, _, edge_attrs in network_edges], ['geometry', 'type', 'length', 'cost']].reset_index(drop=True)
+network_gdf['fdh_id'] = [edge_attrs['fdh_id'] for _, _, edge_attrs in network_edges]
+network_gdf['homes'] = [edge_attrs['homes'] for _, _, edge_attrs in network_edges]
+if include_unit_count:
+    network_gdf['units'] = [edge_attrs['units'] for _, _, edge_attrs in network_edges]
+network_gdf['cable'] = [cable_size(int(np.ceil(edge_attrs['units'] * (1 + SPARE_FIBER)))) for _, _, edge_attrs in network_edges]
 network_gdf.to_file('network.shp')
 
-print("\nDone.")
\ No newline at end of file
+print(f"Saved {len(network_gdf)} network edges.")
+print("Done.")
@@ -2,21 +2,69 @@
 
 import geopandas as gpd
 import networkx as nx
+import numpy as np
+import shapely
 import time
-from shapely.geometry import LineString
+from routing import CompiledGraph, build_graph, route_fdhs
+
+# Routing backend: 'networkx', or 'csgraph' to batch all FDHs through scipy.sparse.csgraph
+ROUTING_BACKEND = 'networkx'
+# Worker processes for routing FDH groups in parallel; more than 1 implies 'csgraph'
+ROUTING_WORKERS = 1
+# Route over chains of degree-2 road nodes contracted into single edges; paths are expanded back
+CONTRACT_CHAINS = True
+# Route each FDH over only the edges within this many feet (> 0) of its homes (widened until all are
+# reached), or None to route every FDH over the whole graph
+FOOTPRINT_BUFFER = None
 
 print("Building the graph...")
 
 # Load shapefiles
 edges_gdf = gpd.read_file('edges.shp')
-nodes_gdf = gpd.read_file('nodes.shp').set_index('id')
 home_points_gdf = gpd.read_file('home_points.shp')
 fdh_gdf = gpd.read_file('fdh.shp')  # Load fdh.shp
 
 # Build the graph
-G = nx.Graph()
-for _, edge in edges_gdf.iterrows():
-    G.add_edge(edge['start_node'], edge['end_node'], weight=edge['cost'], type=edge['type'], length=edge['length'], cost=edge['cost'])
+G = build_graph(edges_gdf)
+
+def build_circuits(edges_gdf, path_nodes, path_offsets):
+    """Build circuit LineStrings along the edges.shp geometry of CSR-stored paths.
+
+    Path i is path_nodes[path_offsets[i]:path_offsets[i + 1]]. Every consecutive node pair
+    is matched to its edges.shp row, the row's coordinates are taken in the direction the
+    path walks it, and all circuits are built in one shapely.linestrings call. Returns the
+    positions of the paths that have at least one edge, their LineStrings and their costs.
+    """
+    path_nodes = np.asarray(path_nodes)
+    path_offsets = np.asarray(path_offsets, dtype=int)
+    edge_counts = np.diff(path_offsets) - 1
+    circuits = np.flatnonzero(edge_counts > 0)
+    not_last = np.ones(len(path_nodes), dtype=bool)
+    not_last[path_offsets[1:] - 1] = False
+    u, v = path_nodes[:-1][not_last[:-1]], path_nodes[1:][not_last[:-1]]
+    circuit_of_edge = np.repeat(np.arange(len(circuits)), edge_counts[circuits])
+
+    graph = CompiledGraph(edges_gdf)
+    rows = graph.edge_rows_between(graph.index_of(u), graph.index_of(v))
+    forward = edges_gdf['start_node'].to_numpy()[rows] == u
+
+    # Coordinates of every edge, and the run of them each path edge uses
+    coords, coord_edge = shapely.get_coordinates(edges_gdf.geometry.values, return_index=True)
+    coord_offsets = np.concatenate(([0], np.cumsum(np.bincount(coord_edge, minlength=len(edges_gdf)))))
+    counts = coord_offsets[rows + 1] - coord_offsets[rows]
+    run_starts = np.cumsum(counts) - counts
+    step = np.arange(counts.sum()) - np.repeat(run_starts, counts)
+    step = np.where(np.repeat(forward, counts), step, np.repeat(counts - 1, counts) - step)
+    take = np.repeat(coord_offsets[rows], counts) + step
+
+    # An edge's first coordinate repeats the last one of the edge before it in the circuit
+    keep = np.ones(len(take), dtype=bool)
+    first_edge = np.concatenate(([True], circuit_of_edge[1:] != circuit_of_edge[:-1]))
+    keep[run_starts[~first_edge]] = False
+    lines = shapely.linestrings(coords[take[keep]], indices=np.repeat(circuit_of_edge, counts)[keep])
+
+    costs = np.bincount(circuit_of_edge, weights=edges_gdf['cost'].to_numpy(dtype=float)[rows], minlength=len(circuits))
+    return circuits, lines, costs
 
 # Create a mapping from fdh_id to node_id for quick lookup
 fdh_to_node = fdh_gdf.set_index('id')['node_id'].to_dict()
@@ -24,14 +72,15 @@ fdh_to_node = fdh_gdf.set_index('id')['node_id'].to_dict()
 # Identify home nodes
 home_nodes = set(home_points_gdf['drop_point'].dropna())
 
-# Store the edges connected to home nodes for re-adding later
-home_node_edges = {}
-for node in home_nodes:
-    home_node_edges[node] = list(G.edges(node, data=True))
+# Mark home nodes as terminal so routes may end at them but never pass through them
+nx.set_node_attributes(G, dict.fromkeys(home_nodes, True), 'terminal')
 
-# Create a new graph to store paths and a list for circuits
+# Create a new graph to store paths, and store the circuits as one flat node array with offsets
 home_graph = nx.Graph()
-circuits_data = []
+circuit_homes = []
+circuit_fdhs = []
+path_nodes = []
+path_offsets = [0]
 
 total = len(home_points_gdf)
 counter = 0
@@ -39,42 +88,27 @@ counter = 0
 # Start the timer
 start_time = time.time()
 
-# Temporary copy of G to modify for each pathfinding operation, excluding home nodes initially
-G_temp = G.copy()
-G_temp.remove_nodes_from(home_nodes)
-
-# Find the minimum cost path from each home node to its associated FDH node and construct circuits
-for _, home_point in home_points_gdf.iterrows():
-    start_node = home_point['drop_point']
-    fdh_id = home_point['fdh_id']
-    if fdh_id in fdh_to_node and start_node in home_node_edges:
-        target_node = fdh_to_node[fdh_id]  # Lookup the target_node using fdh_id
-        
-        # Temporarily add the start node and its edges back to G_temp for pathfinding
-        G_temp.add_node(start_node)
-        G_temp.add_edges_from(home_node_edges[start_node])
-        
-        try:
-            if G_temp.has_node(target_node):  # Ensure the target FDH node exists in the graph
-                path = nx.shortest_path(G_temp, start_node, target_node, weight='cost')
-                # Calculate total cost for the path
-                path_cost = sum(G_temp[path[i]][path[i+1]]['cost'] for i in range(len(path)-1))
-                path_geoms = [nodes_gdf.loc[node, 'geometry'] for node in path if node in nodes_gdf.index]
-                if len(path_geoms) > 1:  # Ensure there are at least two points to form a line
-                    linestring = LineString(path_geoms)
-                    circuits_data.append({
-                        'geometry': linestring,
-                        'home_node': start_node,
-                        'fdh_id': fdh_id,
-                        'cost': path_cost  # Include the total path cost
-                    })
-                for i in range(len(path) - 1):
-                    home_graph.add_edge(path[i], path[i+1], weight=G[path[i]][path[i+1]]['cost'], fdh_id=fdh_id)
-        except nx.NetworkXNoPath:
-            print(f"No path found from home node {start_node} to FDH node {target_node}.")
-        finally:
-            # Remove the start node again to reset G_temp for the next iteration
-            G_temp.remove_node(start_node)
+# Group the routable homes by FDH
+fdh_homes = []
+for fdh_id, homes in home_points_gdf.groupby('fdh_id')['drop_point']:
+    if fdh_id not in fdh_to_node:
+        counter += len(homes)
+        continue
+    routable_homes = [home for home in homes if home in G]
+    counter += len(homes) - len(routable_homes)
+    fdh_homes.append((fdh_id, fdh_to_node[fdh_id], routable_homes))  # Lookup the target node using fdh_id
+
+# Route the homes of each FDH from one shortest-path tree and construct circuits
+for fdh_id, target_node, start_node, path in route_fdhs(G, edges_gdf, fdh_homes, ROUTING_BACKEND, workers=ROUTING_WORKERS, contract=CONTRACT_CHAINS, footprint=FOOTPRINT_BUFFER):
+    if path is None:
+        print(f"No path found from home node {start_node} to FDH node {target_node}.")
+    else:
+        circuit_homes.append(start_node)
+        circuit_fdhs.append(fdh_id)
+        path_nodes.extend(path)
+        path_offsets.append(len(path_nodes))
+        for i in range(len(path) - 1):
+            home_graph.add_edge(path[i], path[i+1], weight=G[path[i]][path[i+1]]['cost'], fdh_id=fdh_id)
 
     counter += 1
     print(f'Progress: {counter}/{total}', end='\r')
@@ -85,7 +119,12 @@ elapsed_time = end_time - start_time
 print(f"\nGraph complete in {elapsed_time:.2f} seconds.")
 
 # Create GeoDataFrame for circuits and save as shapefile
-circuits_gdf = gpd.GeoDataFrame(circuits_data, crs=edges_gdf.crs)
+circuits, lines, costs = build_circuits(edges_gdf, path_nodes, path_offsets)
+circuits_gdf = gpd.GeoDataFrame({
+    'home_node': np.asarray(circuit_homes)[circuits],
+    'fdh_id': np.asarray(circuit_fdhs)[circuits],
+    'cost': costs  # Include the total path cost
+}, geometry=lines, crs=edges_gdf.crs)
 circuits_gdf.to_file('circuits.shp')
 
 print("\nDone.")
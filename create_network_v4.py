@@ -3,9 +3,16 @@
 import geopandas as gpd
 import networkx as nx
 import numpy as np
-from scipy.spatial import KDTree, distance
+from scipy.spatial import KDTree
 import pandas as pd
 import time
+from collections import OrderedDict
+from routing import LandmarkRouter, build_graph, steiner_tree
+
+# Trunk sharing: 'steiner' grows one Takahashi-Matsuyama tree per FDH, 'nearest' joins each
+# home to the Euclidean-nearest node of the network built so far
+TRUNK_SHARING = 'steiner'
+PATH_CACHE_MAX_NODES = 2_000_000  # Bound on the cached paths, counted in path nodes
 
 print("Building the graph...")
 
@@ -16,9 +23,14 @@ home_points_gdf = gpd.read_file('home_points.shp')
 fdh_gdf = gpd.read_file('fdh.shp')
 
 # Build the graph
-G = nx.Graph()
-for _, edge in edges_gdf.iterrows():
-    G.add_edge(edge['start_node'], edge['end_node'], weight=edge['cost'], type=edge['type'], length=edge['length'])
+G = build_graph(edges_gdf)
+
+# Home drop points end a branch but never carry one through to another home
+nx.set_node_attributes(G, dict.fromkeys(home_points_gdf['drop_point'], True), 'terminal')
+
+# In 'nearest' mode, queries on the full graph go through a landmark A* router kept with it
+if TRUNK_SHARING == 'nearest':
+    G.graph['router'] = LandmarkRouter(edges_gdf, weight='cost', terminal_nodes=home_points_gdf['drop_point'], nodes_gdf=nodes_gdf, table_path='landmarks_cost.npz')
 
 # Create KDTree for efficient spatial queries (for nearest node lookups)
 node_coords = np.array(list(zip(nodes_gdf.geometry.x, nodes_gdf.geometry.y)))
@@ -45,37 +57,110 @@ for _, fdh_row in fdh_gdf.iterrows():
     nearest_node_id = find_nearest_node((fdh_point.x, fdh_point.y))
     fdh_to_node[fdh_row['id']] = nearest_node_id
 
+class PathCache:
+    """LRU cache of shortest paths keyed by graph identity and version.
+
+    A graph's version is graph.graph['version'], bumped whenever edges are added, so a path
+    found on an earlier optimized graph is never returned for the current one. Least
+    recently used paths are evicted once the cache holds more than max_nodes path nodes.
+    """
+
+    def __init__(self, max_nodes):
+        self.max_nodes = max_nodes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, graph, start, target):
+        return id(graph), graph.graph.get('version', 0), start, target
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.size += len(entry[1]) + 1
+        while self.size > self.max_nodes:
+            _, (_, path) = self.entries.popitem(last=False)
+            self.size -= len(path) + 1
+            self.evictions += 1
+
+class NearestNodeIndex:
+    """Nearest-node lookups over a growing set of nodes, given by position in nodes_gdf.
+
+    New nodes go to a pending list of at most pending_size nodes, searched by brute force.
+    A full list becomes a KD-tree, merged with any smaller or equal trees into one, so the
+    tree sizes at least double from newest to oldest (the logarithmic method). With
+    O(log n) trees, a lookup costs O(log² n), and each node is rebuilt into a larger tree
+    at most O(log n) times.
+    """
+
+    def __init__(self, coords, pending_size=64):
+        self.coords = coords
+        self.pending_size = pending_size
+        self.members = set()
+        self.trees = []  # (positions, KDTree), oldest and largest first
+        self.pending = []
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, idx):
+        if idx in self.members:
+            return
+        self.members.add(idx)
+        self.pending.append(idx)
+        if len(self.pending) >= self.pending_size:
+            positions = np.array(self.pending)
+            self.pending = []
+            while self.trees and len(self.trees[-1][0]) <= len(positions):
+                positions = np.concatenate((self.trees.pop()[0], positions))
+            self.trees.append((positions, KDTree(self.coords[positions])))
+
+    def nearest(self, point):
+        """Return (position, distance) of the indexed node closest to point."""
+        best_idx, best_distance = None, float('inf')
+        for positions, tree in self.trees:
+            distance, i = tree.query(point, k=1)
+            if distance < best_distance:
+                best_idx, best_distance = positions[i], distance
+        if self.pending:
+            distances = np.linalg.norm(self.coords[self.pending] - point, axis=1)
+            i = np.argmin(distances)
+            if distances[i] < best_distance:
+                best_idx, best_distance = self.pending[i], distances[i]
+        return best_idx, best_distance
+
 # Function to find the nearest node in the optimized graph to a given start node
-def find_nearest_node_in_optimized_graph(optimized_graph, G, start_node, nodes_gdf):
-    if optimized_graph.number_of_nodes() == 0:
+def find_nearest_node_in_optimized_graph(optimized_index, G, start_node):
+    if len(optimized_index) == 0:
         # If the optimized graph has no nodes, return None values
         return None, [], float('inf')
-    
-    # Extract coordinates for the start node and all nodes in the optimized graph
-    start_coords = nodes_gdf.loc[nodes_gdf['id'] == start_node, ['geometry']].values[0][0]
-    optimized_nodes_coords = {node: nodes_gdf.loc[nodes_gdf['id'] == node, ['geometry']].values[0][0] for node in optimized_graph.nodes}
-
-    # Calculate distances from start node to each node in the optimized graph
-    distances = {node: distance.euclidean((start_coords.x, start_coords.y), (coords.x, coords.y)) for node, coords in optimized_nodes_coords.items()}
-    
-    # Find the nearest node and its distance
-    nearest_node = min(distances, key=distances.get)
-    nearest_distance = distances[nearest_node]
-    
+
+    # Find the optimized graph node closest to the start node
+    nearest_idx, _ = optimized_index.nearest(node_coords[node_id_to_idx[start_node]])
+    nearest_node = nodes_gdf['id'].iat[nearest_idx]
+
     # Calculate the shortest path from start node to nearest node in the original graph G
-    try:
-        path = nx.shortest_path(G, source=start_node, target=nearest_node, weight='weight')
-        path_cost = sum(G[u][v]['weight'] for u, v in zip(path[:-1], path[1:]))
-        return nearest_node, path, path_cost
-    except nx.NetworkXNoPath:
+    path_cost, path = calculate_direct_path_cost(G, start_node, nearest_node)
+    if not path:
         # If no path exists, return None values
         return None, [], float('inf')
+    return nearest_node, path, path_cost
 
 # Function to sort homes by distance to FDH
 def sort_homes_by_distance(fdh_id, homes):
     fdh_idx = fdh_id_to_idx[fdh_id]
     fdh_point = fdh_coords[fdh_idx]
-    home_points = np.array([nodes_gdf.loc[nodes_gdf['id'] == h].geometry.apply(lambda x: (x.x, x.y)).values[0] for h in homes])
+    home_points = node_coords[[node_id_to_idx[h] for h in homes]]
     distances = np.linalg.norm(home_points - fdh_point, axis=1)
     sorted_idx = np.argsort(distances)
     return [homes[i] for i in sorted_idx]
@@ -84,21 +169,30 @@ def sort_homes_by_distance(fdh_id, homes):
 start_time = time.time()
 
 optimized_graph = nx.Graph()
+optimized_index = NearestNodeIndex(node_coords)
 
-path_cache = {}
+path_cache = PathCache(PATH_CACHE_MAX_NODES)
 
 def calculate_direct_path_cost(G, start_node, target_node):
-    cache_key = (start_node, target_node)
-    if cache_key in path_cache:
-        return path_cache[cache_key]
+    cache_key = path_cache.key(G, start_node, target_node)
+    cached = path_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        path = nx.shortest_path(G, source=start_node, target=target_node, weight='weight')
-        cost = sum(G[u][v]['weight'] for u, v in zip(path[:-1], path[1:]))
-        path_cache[cache_key] = (cost, path)
+        router = G.graph.get('router')
+        if router is not None:
+            cost, path = router.route(start_node, target_node)
+            if path is None:
+                raise nx.NetworkXNoPath
+        else:
+            path = nx.shortest_path(G, source=start_node, target=target_node, weight='weight')
+            cost = sum(G[u][v]['weight'] for u, v in zip(path[:-1], path[1:]))
+        path_cache.put(cache_key, (cost, path))
         return cost, path
-    except nx.NetworkXNoPath:
-        path_cache[cache_key] = (float('inf'), [])
+    except (nx.NetworkXNoPath, nx.NodeNotFound):
+        # The FDH node is not in the optimized graph until its first home is connected
+        path_cache.put(cache_key, (float('inf'), []))
         return float('inf'), []
 
 # Placeholder for a function that updates the optimized graph with a new path
@@ -106,6 +200,9 @@ def update_network_with_path(optimized_graph, path, G):
     for start, end in zip(path[:-1], path[1:]):
         if not optimized_graph.has_edge(start, end):
             optimized_graph.add_edge(start, end, weight=G[start][end]['weight'])
+            optimized_graph.graph['version'] = optimized_graph.graph.get('version', 0) + 1
+            optimized_index.add(node_id_to_idx[start])
+            optimized_index.add(node_id_to_idx[end])
 
 # Before starting the main loop, initialize variables to track progress
 total_homes = sum(len(homes) for homes in fdh_to_homes.values())
@@ -114,6 +211,16 @@ processed_homes = 0
 # Main loop for pathfinding and updating the optimized graph
 for fdh_id, homes in fdh_to_homes.items():
     target_node = fdh_to_node[fdh_id]  # Assuming fdh_to_node is correctly defined earlier
+    if TRUNK_SHARING == 'steiner':
+        # Each branch runs from a home to the nearest node already in this FDH's tree
+        for home, branch in steiner_tree(G, target_node, homes, weight='weight'):
+            if branch is not None:
+                update_network_with_path(optimized_graph, branch, G)
+        processed_homes += len(homes)
+        progress_percentage = (processed_homes / total_homes) * 100
+        print(f"\rProgress: {processed_homes}/{total_homes} homes processed ({progress_percentage:.2f}%)", end='')
+        continue
+
     sorted_homes = sort_homes_by_distance(fdh_id, homes)
     for home in sorted_homes:
         start_node = home  # Assuming 'home' is already a node ID in G
@@ -122,12 +229,12 @@ for fdh_id, homes in fdh_to_homes.items():
         direct_cost, direct_path = calculate_direct_path_cost(G, start_node, target_node)
 
         # Find the nearest node in the optimized graph to the home
-        nearest_optimized_node, nearest_optimized_path, nearest_optimized_cost = find_nearest_node_in_optimized_graph(optimized_graph, G, start_node, nodes_gdf)
+        nearest_optimized_node, nearest_optimized_path, nearest_optimized_cost = find_nearest_node_in_optimized_graph(optimized_index, G, start_node)
 
         # Calculate path cost from the nearest optimized node to FDH through the existing network
         if nearest_optimized_node is not None:
-            _, path_from_nearest = calculate_direct_path_cost(optimized_graph, nearest_optimized_node, target_node)
-            total_optimized_cost = nearest_optimized_cost + sum(optimized_graph[u][v]['weight'] for u, v in zip(path_from_nearest[:-1], path_from_nearest[1:]))
+            cost_from_nearest, path_from_nearest = calculate_direct_path_cost(optimized_graph, nearest_optimized_node, target_node)
+            total_optimized_cost = nearest_optimized_cost + cost_from_nearest
         else:
             total_optimized_cost = float('inf')
 
@@ -150,6 +257,7 @@ print("\nOptimization complete.")
 end_time = time.time()
 elapsed_time = end_time - start_time
 print(f"Optimization complete in {elapsed_time:.2f} seconds.")
+print(f"Path cache: {path_cache.hits} hits, {path_cache.misses} misses, {path_cache.evictions} evictions.")
 
 # TODO: Add the implementation for direct and existing network path calculations and updates
 
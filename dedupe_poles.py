@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import geopandas as gpd
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.spatial import cKDTree
+
+# Constants
+TOLERANCE = 2  # Poles closer than this (in CRS units, feet) are treated as one structure
+
+def group_colocated_points(coords, tolerance):
+    """Label points so that every point shares a label with a seed point within tolerance.
+
+    A KD-tree finds all pairs of points within tolerance. Points are then taken in order,
+    and each one not yet grouped becomes a seed that absorbs its ungrouped neighbours. A
+    group never reaches beyond tolerance of its seed, so a line of poles each just under
+    tolerance apart is not chained into one. The seed is the first point of its group, and
+    labels are numbered 0..n_groups-1.
+    """
+    n = len(coords)
+    pairs = cKDTree(coords).query_pairs(r=tolerance, output_type='ndarray')
+    neighbours = coo_matrix((np.ones(2 * len(pairs), dtype=np.int8), (np.concatenate((pairs[:, 0], pairs[:, 1])), np.concatenate((pairs[:, 1], pairs[:, 0])))), shape=(n, n)).tocsr()
+
+    seeds = np.arange(n)
+    grouped = np.zeros(n, dtype=bool)
+    # Points without a neighbour are their own seeds, so only the rest need the greedy pass
+    for i in np.unique(pairs).tolist():
+        if grouped[i]:
+            continue
+        grouped[i] = True
+        absorbed = neighbours.indices[neighbours.indptr[i]:neighbours.indptr[i + 1]]
+        absorbed = absorbed[~grouped[absorbed]]
+        seeds[absorbed] = i
+        grouped[absorbed] = True
+
+    return np.unique(seeds, return_inverse=True)[1]
+
+print("Removing duplicate poles...")
+
+# Load the poles shapefile
+poles_gdf = gpd.read_file('poles.shp')
+
+# Drop poles that cannot be hashed
+valid = poles_gdf.geometry.notnull() & ~poles_gdf.geometry.is_empty
+valid &= np.isfinite(poles_gdf.geometry.x) & np.isfinite(poles_gdf.geometry.y)
+if not valid.all():
+    print(f"Found {(~valid).sum()} poles with missing or non-finite geometry. Removing them.")
+    poles_gdf = poles_gdf[valid].reset_index(drop=True)
+
+coords = np.column_stack((poles_gdf.geometry.x.values, poles_gdf.geometry.y.values))
+labels = group_colocated_points(coords, TOLERANCE)
+
+# Keep the first pole of every group as its representative, along with its attributes
+_, keep, group_sizes = np.unique(labels, return_index=True, return_counts=True)
+deduped_gdf = poles_gdf.iloc[keep].copy()
+deduped_gdf['merged'] = group_sizes - 1
+deduped_gdf = deduped_gdf.sort_index()
+
+num_merged = len(poles_gdf) - len(deduped_gdf)
+print(f"{num_merged} of {len(poles_gdf)} poles were within {TOLERANCE} ft of another pole and have been merged.")
+
+# Save the deduplicated poles back to the shapefile
+deduped_gdf.to_file('poles.shp')
+
+print("Deduplicated poles have been saved to poles.shp.")
@@ -6,5 +6,6 @@ associate_drop_points_v2.py
 cluster_fdh_v2.py
 create_network_v2.py
 create_mst_clusters.py
+create_feeder.py
 report.py
 create_map_buried.py
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 centerlines_from_homes.py
 drops_split_centerlines.py
+dedupe_poles.py
 create_aerial_drops.py
 create_aerial_edges.py
 create_transitions.py
@@ -11,5 +12,6 @@ cluster_fdh_v2.py
 create_network_v2.py
 create_mst_clusters.py
 poles_used.py
+create_feeder.py
 report.py
 create_map.py
\ No newline at end of file
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from report import build_report
+from routing import CompiledGraph
+
+# Cost per foot of each edge type, as set by the scripts that create the edges
+BASE_RATES = {
+    'Underground': 1000.00,  # underground_cpf in drops_split_centerlines.py
+    'Buried Drop': 200.00,  # buried_drop_cpf in drops_split_centerlines.py
+    'Aerial': 2.5,  # COST_PER_UNIT in create_aerial_edges.py
+    'Aerial Drop': 1.5,  # COST_PER_FOOT in create_aerial_drops.py
+    'Transition': 1000,  # COST_PER_FOOT in create_transitions.py
+}
+# Rates each scenario changes from BASE_RATES; edge types without a rate keep their edges.shp cost
+SCENARIOS = {
+    'Base': {},
+    'Underground 750': {'Underground': 750.00, 'Transition': 750},
+    'Aerial 10': {'Aerial': 10.0, 'Aerial Drop': 6.0},
+}
+SCENARIO_WORKERS = os.cpu_count() or 1
+OUTPUT_PATH = 'scenarios.xlsx'
+
+def scenario_costs(overrides):
+    """Return the cost of every edges.shp row under BASE_RATES updated with overrides."""
+    rate = edges_gdf['type'].map({**BASE_RATES, **overrides}).to_numpy(dtype=float)
+    return np.where(np.isnan(rate), edges_gdf['cost'].to_numpy(dtype=float), edges_gdf['length'].to_numpy(dtype=float) * rate)
+
+def route_scenario(name):
+    """Route every FDH under one scenario and return its network as (edges.shp rows, fdh_ids)."""
+    graph = base_graph.reweighted(scenario_costs(SCENARIOS[name]))
+    network = {}
+    for fdh_id, _, _, path in graph.route_fdh_trees(fdh_homes):
+        if path is None:
+            continue
+        # Later FDHs take over shared edges, as in create_network_v2.py
+        for u, v in zip(path[:-1], path[1:]):
+            network[(u, v) if u <= v else (v, u)] = fdh_id
+    u, v = zip(*network) if network else ((), ())
+    rows = graph.edge_rows_between(graph.index_of(list(u)), graph.index_of(list(v)))
+    return rows, np.array(list(network.values()))
+
+def summarize_scenario(name, network_gdf, homes_passed):
+    """Summarize footage and cost of one scenario's network."""
+    feet = network_gdf.geometry.length.groupby(network_gdf['type']).sum()
+    total_cost = network_gdf['cost'].sum()
+    return {
+        'Scenario': name,
+        'HP': homes_passed,
+        'Aerial': round(feet.get('Aerial', 0)),
+        'Underground': round(feet.get('Underground', 0) + feet.get('Transition', 0)),
+        'Drops': round(feet.get('Aerial Drop', 0) + feet.get('Buried Drop', 0)),
+        'Total Cost': round(total_cost),
+        'Cost per HP': round(total_cost / homes_passed, 2) if homes_passed > 0 else 0,
+    }
+
+print("Compiling the graph...")
+
+# Load shapefiles
+edges_gdf = gpd.read_file('edges.shp')
+home_points_gdf = gpd.read_file('home_points.shp')
+fdh_gdf = gpd.read_file('fdh.shp')
+
+# Topology and terminal homes are compiled once; each scenario only swaps the edge weights
+home_nodes = set(home_points_gdf['drop_point'].dropna())
+base_graph = CompiledGraph(edges_gdf, terminal_nodes=home_nodes)
+fdh_to_node = fdh_gdf.set_index('id')['node_id'].to_dict()
+fdh_homes = [(fdh_id, fdh_to_node[fdh_id], list(homes)) for fdh_id, homes in home_points_gdf.groupby('fdh_id')['drop_point'] if fdh_id in fdh_to_node]
+
+print(f"Routing {len(SCENARIOS)} cost scenarios in parallel...")
+
+# Workers are forked, so they share the compiled graph instead of each reading edges.shp
+context = multiprocessing.get_context('fork')
+with ProcessPoolExecutor(max_workers=max(1, min(len(SCENARIOS), SCENARIO_WORKERS)), mp_context=context) as executor:
+    results = dict(zip(SCENARIOS, executor.map(route_scenario, SCENARIOS)))
+
+summary = []
+reports = {}
+for name, (rows, fdh_ids) in results.items():
+    network_gdf = edges_gdf.iloc[rows][['geometry', 'type', 'length']].reset_index(drop=True)
+    network_gdf['cost'] = scenario_costs(SCENARIOS[name])[rows]
+    network_gdf['fdh_id'] = fdh_ids
+    summary.append(summarize_scenario(name, network_gdf, len(home_points_gdf)))
+    reports[name] = build_report(network_gdf, home_points_gdf)
+
+summary_df = pd.DataFrame(summary)
+print(summary_df.to_string(index=False))
+
+# One summary sheet, then the network report of every scenario
+with pd.ExcelWriter(OUTPUT_PATH, engine='openpyxl') as writer:
+    summary_df.to_excel(writer, sheet_name='Summary', index=False)
+    for name, report_df in reports.items():
+        report_df.to_excel(writer, sheet_name=name[:31], index=False)
+
+print(f"Scenario comparison has been saved to {OUTPUT_PATH}.")
@@ -0,0 +1,626 @@
+"""Graph routines shared by the clustering and network scripts.
+
+The scripts are run from the project folder but import this module from the scripts
+folder next to them, so it only defines functions and never reads shapefiles itself.
+"""
+
+import copy
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+# Upper bound on the memory used by one batch of dense Dijkstra rows
+BATCH_MEMORY = 256 * 1024 * 1024  # bytes
+
+# Stand-in for the distance from a landmark to a node it cannot reach
+UNREACHABLE_BOUND = 1e30
+
+class CompiledGraph:
+    """edges.shp compiled into a CSR matrix for scipy.sparse.csgraph.
+
+    Node ids are sorted and mapped to matrix indices 0..n-1, so node_ids[i] is the id of
+    row i. Parallel edges keep the cheapest one, and edge_rows holds the edges_gdf row
+    behind every stored entry. Edges leaving a terminal node are left out, so paths may
+    start or end at a terminal (a home drop point) but never pass through one.
+    """
+
+    def __init__(self, edges_gdf, weight='cost', terminal_nodes=()):
+        start = edges_gdf['start_node'].to_numpy()
+        end = edges_gdf['end_node'].to_numpy()
+        self.node_ids, endpoints = np.unique(np.concatenate((start, end)), return_inverse=True)
+        self.node_index = pd.Index(self.node_ids)
+        self.is_terminal = self.node_index.isin(list(terminal_nodes))
+
+        # Both directions of every edge, except those leaving a terminal
+        u, v = endpoints[:len(start)], endpoints[len(start):]
+        rows = np.concatenate((u, v))
+        cols = np.concatenate((v, u))
+        edge_rows = np.tile(np.arange(len(start)), 2)
+        keep = (rows != cols) & ~self.is_terminal[rows]
+        self._topology = rows[keep], cols[keep], edge_rows[keep]
+        self._compile(edges_gdf[weight].to_numpy(dtype=float))
+
+    def _compile(self, edge_weights):
+        # Sort the directed edges by (row, col, weight, edges_gdf row) and keep the cheapest of
+        # any parallel ones, the first in edges_gdf on a tie, so both directions keep the same
+        rows, cols, edge_rows = self._topology
+        weights = edge_weights[edge_rows]
+        order = np.lexsort((edge_rows, weights, cols, rows))
+        rows, cols, weights, edge_rows = rows[order], cols[order], weights[order], edge_rows[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, weights, edge_rows = rows[first], cols[first], weights[first], edge_rows[first]
+
+        n = len(self.node_ids)
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n))))
+        self.matrix = csr_matrix((weights, cols, indptr), shape=(n, n))
+        self.edge_rows = edge_rows
+        self._keys = rows.astype(np.int64) * n + cols
+
+    def reweighted(self, edge_weights):
+        """Return a graph with the same nodes, edges and terminals but new weights.
+
+        edge_weights holds one weight per edges_gdf row. Only the CSR arrays are rebuilt,
+        so cost scenarios never read or compile edges.shp again.
+        """
+        graph = copy.copy(self)
+        graph._compile(np.asarray(edge_weights, dtype=float))
+        return graph
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def index_of(self, ids):
+        """Map node ids to matrix indices, with -1 for ids that are not in the graph."""
+        return self.node_index.get_indexer(ids)
+
+    def edge_rows_between(self, u, v):
+        """Return the edges_gdf row joining each pair of node indices u[i], v[i] (-1 if none)."""
+        u, v = np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64)
+        rows = np.full(len(u), -1)
+        for a, b in ((u, v), (v, u)):
+            keys = a * len(self) + b
+            pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+            found = (rows < 0) & (self._keys[pos] == keys)
+            rows[found] = self.edge_rows[pos[found]]
+        return rows
+
+    def distances(self, sources, limit=np.inf):
+        """Yield (sources, distance rows) for source indices, batched to bound memory.
+
+        Each batch is a single csgraph.dijkstra call; entries beyond limit are inf.
+        """
+        sources = np.asarray(sources)
+        batch_size = max(1, BATCH_MEMORY // (8 * max(len(self), 1)))
+        for i in range(0, len(sources), batch_size):
+            batch = sources[i:i + batch_size]
+            yield batch, dijkstra(self.matrix, directed=True, indices=batch, limit=limit)
+
+    def shortest_path_trees(self, sources, limit=np.inf):
+        """Yield (sources, distances, predecessors) for source indices in memory-bounded batches.
+
+        Each batch is a single csgraph.dijkstra call; a predecessor below zero marks a node
+        outside that source's tree.
+        """
+        sources = np.asarray(sources)
+        batch_size = max(1, BATCH_MEMORY // (12 * max(len(self), 1)))
+        for i in range(0, len(sources), batch_size):
+            batch = sources[i:i + batch_size]
+            dist, pred = dijkstra(self.matrix, directed=True, indices=batch, return_predecessors=True, limit=limit)
+            yield batch, dist, pred
+
+    def route_fdh_trees(self, fdh_homes, workers=1):
+        """Route homes to their FDHs with batched multi-source Dijkstra over the CSR graph.
+
+        fdh_homes is a list of (fdh_id, fdh_node, homes). Yields the same
+        (fdh_id, fdh_node, home, path) tuples as route_fdhs, with node ids in the path.
+        With workers > 1, groups of FDHs are routed in a process pool.
+        """
+        fdh_idx = self.index_of([fdh_node for _, fdh_node, _ in fdh_homes])
+        for i in np.flatnonzero(fdh_idx < 0):
+            fdh_id, fdh_node, homes = fdh_homes[i]
+            for home in homes:
+                yield fdh_id, fdh_node, home, None
+
+        routable = np.flatnonzero(fdh_idx >= 0)
+        tasks = [(fdh_idx[i], self.index_of(fdh_homes[i][2])) for i in routable]
+        for i, paths in zip(routable, self._route_tasks(tasks, workers)):
+            fdh_id, fdh_node, homes = fdh_homes[i]
+            for home, path in zip(homes, paths):
+                yield fdh_id, fdh_node, home, None if path is None else self.node_ids[path].tolist()
+
+    def _route_tasks(self, tasks, workers):
+        """Yield the home paths of each (source, targets) task, in task order."""
+        batch_size = max(1, BATCH_MEMORY // (12 * max(len(self), 1)))
+        if workers <= 1:
+            for i in range(0, len(tasks), batch_size):
+                yield from _route_task_batch(self.matrix, tasks[i:i + batch_size])
+            return
+
+        # Several groups per worker so that a few large FDHs do not leave cores idle
+        group_size = max(1, min(batch_size, -(-len(tasks) // (workers * 4))))
+        groups = [tasks[i:i + group_size] for i in range(0, len(tasks), group_size)]
+        with tempfile.TemporaryDirectory() as folder:
+            # Workers memory-map the CSR arrays, so every process shares one copy in the page cache
+            paths = {}
+            for name in ('data', 'indices', 'indptr'):
+                paths[name] = os.path.join(folder, f'{name}.npy')
+                np.save(paths[name], getattr(self.matrix, name))
+            # fork, because the scripts have no __main__ guard and must not be re-run in each worker
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_load_shared_graph, initargs=(paths, self.matrix.shape)) as executor:
+                # map returns groups in submission order, so results merge deterministically
+                for group_paths in executor.map(_route_shared_task_batch, groups):
+                    yield from group_paths
+
+def _tree_paths(dist, pred, source, targets):
+    """Walk a predecessor row back from each target to the source (None if unreachable)."""
+    paths = []
+    for target in targets:
+        if target < 0 or not np.isfinite(dist[target]):
+            paths.append(None)
+            continue
+        path = [target]
+        while path[-1] != source:
+            path.append(pred[path[-1]])
+        paths.append(np.array(path))
+    return paths
+
+def _route_task_batch(matrix, tasks):
+    """Route a batch of (source, targets) tasks with one csgraph.dijkstra call."""
+    sources = [source for source, _ in tasks]
+    dist, pred = dijkstra(matrix, directed=True, indices=sources, return_predecessors=True)
+    return [_tree_paths(dist[k], pred[k], source, targets) for k, (source, targets) in enumerate(tasks)]
+
+# CSR graph memory-mapped by each routing worker process
+_shared_matrix = None
+
+def _load_shared_graph(paths, shape):
+    global _shared_matrix
+    arrays = {name: np.load(path, mmap_mode='r') for name, path in paths.items()}
+    _shared_matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=shape, copy=False)
+
+def _route_shared_task_batch(tasks):
+    return _route_task_batch(_shared_matrix, tasks)
+
+class LandmarkRouter:
+    """Point-to-point A* queries over edges.shp with ALT landmark bounds.
+
+    Distances from a few landmark nodes are computed once with csgraph.dijkstra. By the
+    triangle inequality |d(L, t) - d(L, v)| never overestimates the cost from v to t, so
+    A* uses the best such bound over all landmarks and settles only a fraction of the
+    nodes a plain Dijkstra would. Given nodes_gdf, the straight-line distance times the
+    cheapest cost per foot of any edge is a second bound, and the only one when
+    n_landmarks is 0. Terminal nodes may start or end a route but are never passed
+    through; the bounds come from the unrestricted graph, so they stay admissible. The
+    landmark tables are saved to table_path and reused while the graph is unchanged.
+    """
+
+    def __init__(self, edges_gdf, weight='cost', terminal_nodes=(), nodes_gdf=None, n_landmarks=8, table_path=None):
+        self.graph = CompiledGraph(edges_gdf, weight=weight)
+        self.is_terminal = self.graph.node_index.isin(list(terminal_nodes)).tolist()
+        matrix = self.graph.matrix
+        self.settled = 0
+
+        self.coords = None
+        if nodes_gdf is not None:
+            nodes = nodes_gdf.drop_duplicates('id')
+            position = pd.Index(nodes['id']).get_indexer(self.graph.node_ids)
+            xy = np.column_stack((nodes.geometry.x.values, nodes.geometry.y.values))
+            self.coords = np.where((position >= 0)[:, None], xy[position], np.nan)
+            # Scaled by the cheapest cost per foot of straight line between an edge's end
+            # nodes, the straight line from any node to the target never overestimates
+            rows = np.repeat(np.arange(len(self.graph)), np.diff(matrix.indptr))
+            straight = np.hypot(*(self.coords[rows] - self.coords[matrix.indices]).T)
+            usable = straight > 0
+            self.min_cost_per_unit = np.min(matrix.data[usable] / straight[usable], initial=np.inf)
+            if not np.isfinite(self.min_cost_per_unit):
+                self.coords = None
+
+        self.landmarks = np.empty(0, dtype=int)
+        self.landmark_dist = np.empty((len(self.graph), 0))
+        if n_landmarks > 0 and len(self.graph) > 0:
+            fingerprint = self._fingerprint(n_landmarks)
+            if table_path and os.path.exists(table_path):
+                with np.load(table_path) as table:
+                    if str(table['fingerprint']) == fingerprint:
+                        self.landmarks, self.landmark_dist = table['landmarks'], table['landmark_dist']
+            if len(self.landmarks) == 0:
+                self.landmarks, self.landmark_dist = self._compute_landmarks(n_landmarks)
+                if table_path:
+                    np.savez(table_path, fingerprint=fingerprint, landmarks=self.landmarks, landmark_dist=self.landmark_dist)
+
+        # Nodes a landmark cannot reach get a huge finite distance instead of inf. Two such
+        # nodes share its bound of zero, and a node and target split by it are in different
+        # components, where no bound can be too high.
+        self._landmark_bounds = np.where(np.isfinite(self.landmark_dist), self.landmark_dist, UNREACHABLE_BOUND)
+
+    def _fingerprint(self, n_landmarks):
+        digest = hashlib.sha1(str(n_landmarks).encode())
+        for array in (self.graph.node_ids, self.graph.matrix.indptr, self.graph.matrix.indices, self.graph.matrix.data):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def _compute_landmarks(self, n_landmarks):
+        # Each landmark is the node farthest from those already chosen. Unreachable nodes
+        # count as farthest, so every component gets a landmark before any gets two.
+        # Choosing the next landmark needs the last table, so they are computed one at a time.
+        _, dist = next(self.graph.distances([0]))
+        candidate = int(np.argmax(np.where(np.isfinite(dist[0]), dist[0], -1)))
+        nearest = np.full(len(self.graph), np.inf)
+        landmarks, tables = [], []
+        for _ in range(min(n_landmarks, len(self.graph))):
+            _, dist = next(self.graph.distances([candidate]))
+            landmarks.append(candidate)
+            tables.append(dist[0])
+            nearest = np.minimum(nearest, dist[0])
+            candidate = int(np.argmax(nearest))
+            if nearest[candidate] == 0:
+                break
+        return np.array(landmarks), np.column_stack(tables)
+
+    def _bound(self, target):
+        """Return a function giving lower bounds on the cost from an array of node indices to target."""
+        target_dist = self._landmark_bounds[target]
+        target_xy = self.coords[target] if self.coords is not None else None
+
+        def bound(v):
+            h = np.zeros(len(v))
+            if len(target_dist):
+                h = np.abs(self._landmark_bounds[v] - target_dist).max(axis=1)
+            if target_xy is not None:
+                straight = np.hypot(*(self.coords[v] - target_xy).T) * self.min_cost_per_unit
+                h = np.fmax(h, straight)
+            return h
+        return bound
+
+    def route(self, source, target):
+        """Return (cost, path of node ids from source to target), or (inf, None) if unreachable."""
+        s, t = (int(i) for i in self.graph.index_of([source, target]))
+        if s < 0 or t < 0:
+            return np.inf, None
+
+        bound = self._bound(t)
+        indptr, indices, data = self.graph.matrix.indptr, self.graph.matrix.indices, self.graph.matrix.data
+        best = {s: 0.0}
+        pred = {s: s}
+        closed = set()
+        heap = [(float(bound([s])[0]), 0.0, s)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if u in closed:
+                continue
+            closed.add(u)
+            if u == t:
+                self.settled += len(closed)
+                path = [t]
+                while path[-1] != s:
+                    path.append(pred[path[-1]])
+                return d, self.graph.node_ids[path[::-1]].tolist()
+            if u != s and self.is_terminal[u]:
+                continue
+            # Bounds are computed for all neighbours of u at once
+            neighbours = indices[indptr[u]:indptr[u + 1]]
+            costs = d + data[indptr[u]:indptr[u + 1]]
+            for v, nd, h in zip(neighbours.tolist(), costs.tolist(), bound(neighbours).tolist()):
+                if v in closed or nd >= best.get(v, np.inf) or h == np.inf:
+                    continue
+                best[v] = nd
+                pred[v] = u
+                heapq.heappush(heap, (nd + h, nd, v))
+        self.settled += len(closed)
+        return np.inf, None
+
+    def distance(self, source, target):
+        """Return the route cost from source to target (inf if unreachable)."""
+        return self.route(source, target)[0]
+
+def build_graph(edges_gdf):
+    """Build the networkx graph of edges_gdf with the edges CompiledGraph keeps.
+
+    Of any parallel edges only the cheapest is added, and self-loops are dropped, so routes
+    over either graph use the same edges. Every edge has weight and cost (both the edge
+    cost), type, length and row, its edges_gdf row.
+    """
+    graph = CompiledGraph(edges_gdf)
+    indptr = graph.matrix.indptr
+    starts = np.repeat(np.arange(len(graph)), np.diff(indptr))
+    rows = graph.edge_rows[starts < graph.matrix.indices]
+    edges = edges_gdf.iloc[rows]
+    G = nx.Graph()
+    for row, u, v, edge_type, length, cost in zip(rows.tolist(), edges['start_node'], edges['end_node'], edges['type'], edges['length'], edges['cost']):
+        G.add_edge(u, v, weight=cost, type=edge_type, length=length, cost=cost, row=row)
+    return G
+
+def terminal_weight(G, source, weight='cost'):
+    """Return a networkx weight function that never relaxes through a terminal node.
+
+    Nodes with the 'terminal' attribute set can still be reached, and the source may be
+    left even if it is a terminal itself.
+    """
+    def transit_weight(u, v, data):
+        # Returning None hides the edge, so a terminal is reached but never left
+        if u != source and G.nodes[u].get('terminal'):
+            return None
+        return data[weight]
+    return transit_weight
+
+def route_fdh_tree(G, fdh_node, homes, weight='cost'):
+    """Route every home of one FDH from a single shortest-path tree grown at the FDH node.
+
+    Nodes with the 'terminal' attribute set (home drop points) may start or end a path but
+    are never relaxed through, so no route passes through another customer's drop and G is
+    never copied or modified. This replaces one Dijkstra per home with one per FDH. Yields
+    (home, path) pairs with the path running from the home to the FDH, or (home, None) if
+    the home cannot be reached.
+    """
+    if fdh_node not in G:
+        for home in homes:
+            yield home, None
+        return
+
+    pred, dist = nx.dijkstra_predecessor_and_distance(G, fdh_node, weight=terminal_weight(G, fdh_node, weight))
+    for home in homes:
+        if home not in dist:
+            yield home, None
+            continue
+
+        path = [home]
+        while path[-1] != fdh_node:
+            path.append(pred[path[-1]][0])
+        yield home, path
+
+def steiner_tree(G, root, terminals, weight='cost'):
+    """Connect terminals to root with the Takahashi-Matsuyama shortest-path heuristic.
+
+    The tree starts as the root alone. The unconnected terminal closest to any tree node is
+    joined by its shortest path to the tree, and a multi-source Dijkstra seeded at zero
+    cost from the new tree nodes then lowers the distances it improves. The whole run costs
+    a few full Dijkstras rather than one per terminal. Nodes with the 'terminal' attribute
+    set are never relaxed through, as in route_fdh_tree. Yields (terminal, branch) in
+    connection order, where the branch runs from the terminal to the tree node it joins,
+    then (terminal, None) for every terminal that cannot be reached.
+    """
+    remaining = dict.fromkeys(terminals)
+    if root not in G:
+        for terminal in remaining:
+            yield terminal, None
+        return
+
+    dist = {}
+    pred = {}
+    in_tree = {root}
+    candidates = []
+    counter = itertools.count()
+
+    def grow(seeds, bound=float('inf')):
+        # Only nodes whose distance to the tree improves are settled again, and nothing
+        # farther than the farthest remaining terminal can shorten a remaining path
+        frontier = []
+        for seed in seeds:
+            dist[seed] = 0.0
+            heapq.heappush(frontier, (0.0, next(counter), seed))
+        while frontier:
+            d, _, u = heapq.heappop(frontier)
+            if d > bound:
+                break
+            if d > dist[u]:
+                continue
+            if u in remaining:
+                heapq.heappush(candidates, (d, next(counter), u))
+            if u != root and G.nodes[u].get('terminal'):
+                continue
+            for v, data in G.adj[u].items():
+                nd = d + data[weight]
+                if nd < dist.get(v, float('inf')):
+                    dist[v] = nd
+                    pred[v] = u
+                    heapq.heappush(frontier, (nd, next(counter), v))
+
+    grow([root])
+    while candidates:
+        d, _, terminal = heapq.heappop(candidates)
+        if terminal not in remaining or d > dist[terminal]:
+            continue
+        branch = [terminal]
+        while branch[-1] not in in_tree:
+            branch.append(pred[branch[-1]])
+        del remaining[terminal]
+        in_tree.update(branch)
+        yield terminal, branch
+        grow(branch[:-1], max((dist[t] for t in remaining if t in dist), default=-1.0))
+
+    for terminal in remaining:
+        yield terminal, None
+
+def downstream_totals(parent, weights):
+    """Total the weights below every edge of a tree given as a child -> parent mapping.
+
+    Nodes are ordered breadth-first from the root and visited in reverse, so each subtree
+    total is complete before it is added to its parent. This is one O(tree size) pass
+    instead of a walk along every home's path. Returns {child: total} for the edge from
+    each child to its parent; weights maps nodes to their own weight (e.g. homes there).
+    """
+    children = {}
+    for child, node in parent.items():
+        children.setdefault(node, []).append(child)
+    order = [node for node in children if node not in parent]
+    for node in order:
+        order.extend(children.get(node, ()))
+
+    totals = dict.fromkeys(parent, 0)
+    for node in reversed(order):
+        if node in parent:
+            totals[node] += weights.get(node, 0)
+            if parent[node] in totals:
+                totals[parent[node]] += totals[node]
+    return totals
+
+def contract_chains(edges_gdf, keep_nodes=(), weight='cost'):
+    """Contract chains of degree-2 nodes in edges_gdf into super-edges.
+
+    Roads split at every drop and pole leave long chains of nodes with two neighbours,
+    which a route can only pass straight through. Every node that does not have exactly
+    two neighbours, or is in keep_nodes (homes and FDHs), ends a chain; each chain between
+    two such nodes becomes one edge with the summed cost and length of its edges. Parallel
+    edges and parallel chains keep the cheapest by weight, and chains that loop back to
+    their start are dropped. Returns a DataFrame with start_node, end_node, cost, length,
+    rows (the edges_gdf rows along the chain) and nodes (its node ids, start to end).
+    """
+    graph = CompiledGraph(edges_gdf, weight=weight)
+    indptr, indices = graph.matrix.indptr, graph.matrix.indices.tolist()
+    edge_rows = graph.edge_rows.tolist()
+    degree = np.diff(indptr)
+    kept = (degree != 2) | graph.node_index.isin(list(keep_nodes))
+    kept_list = kept.tolist()
+    costs = edges_gdf['cost'].to_numpy(dtype=float)
+    lengths = edges_gdf['length'].to_numpy(dtype=float)
+    weights = edges_gdf[weight].to_numpy(dtype=float)
+
+    chains = {}
+    visited = set()
+    for start in np.flatnonzero(kept & (degree > 0)).tolist():
+        for k in range(indptr[start], indptr[start + 1]):
+            if edge_rows[k] in visited:
+                continue
+            # Walk on through each degree-2 node to the next node that ends a chain
+            nodes, rows = [start, indices[k]], [edge_rows[k]]
+            while not kept_list[nodes[-1]]:
+                a = indptr[nodes[-1]]
+                step = a if indices[a] != nodes[-2] else a + 1
+                nodes.append(indices[step])
+                rows.append(edge_rows[step])
+            visited.update(rows)
+            end = nodes[-1]
+            if end == start:
+                continue
+            key = (start, end) if start < end else (end, start)
+            chain_weight = weights[rows].sum()
+            if key not in chains or chain_weight < chains[key][0]:
+                chains[key] = (chain_weight, nodes if start < end else nodes[::-1], rows if start < end else rows[::-1])
+
+    chain_list = [(graph.node_ids[nodes].tolist(), rows) for _, nodes, rows in chains.values()]
+    return pd.DataFrame({
+        'start_node': [nodes[0] for nodes, _ in chain_list],
+        'end_node': [nodes[-1] for nodes, _ in chain_list],
+        'cost': [costs[rows].sum() for _, rows in chain_list],
+        'length': [lengths[rows].sum() for _, rows in chain_list],
+        'rows': [rows for _, rows in chain_list],
+        'nodes': [nodes for nodes, _ in chain_list],
+    })
+
+def expand_path(path, chain_nodes):
+    """Replace every hop of a path over contracted chains with the nodes along its chain.
+
+    chain_nodes maps (start_node, end_node) of each chain, in both directions, to its node ids.
+    """
+    expanded = [path[0]]
+    for u, v in zip(path[:-1], path[1:]):
+        expanded.extend(chain_nodes[u, v][1:])
+    return expanded
+
+def _route_footprint(job, entry):
+    """Route one FDH over the edges near its homes, widening the footprint until all are reached."""
+    G, edges_gdf, touching, extent, backend, weight, contract, buffer = job
+    _, fdh_node, homes = entry
+    near = touching.loc[touching.index.intersection([fdh_node, *homes])].to_numpy()
+    hull = shapely.convex_hull(shapely.geometrycollections(edges_gdf.geometry.values[near])) if len(near) else None
+    while True:
+        area = None if hull is None or hull.is_empty or extent is None else shapely.buffer(hull, buffer)
+        # Once the footprint covers every edge's extent, edges the spatial index cannot
+        # return (null or empty geometry) are only added by routing over the whole graph
+        if area is None or area.covers(extent):
+            rows = np.arange(len(edges_gdf))
+        else:
+            rows = np.sort(edges_gdf.sindex.query(area, predicate='intersects'))
+        sub_edges = edges_gdf.iloc[rows]
+        sub_G = G.edge_subgraph(zip(sub_edges['start_node'], sub_edges['end_node']))
+        routes = list(route_fdhs(sub_G, sub_edges, [entry], backend, weight, contract=contract))
+        if len(rows) == len(edges_gdf) or all(path is not None for _, _, _, path in routes):
+            return routes
+        buffer *= 2
+
+# Footprint routing job shared with forked worker processes
+_footprint_job = None
+
+def _route_shared_footprint(entry):
+    return _route_footprint(_footprint_job, entry)
+
+def route_fdhs(G, edges_gdf, fdh_homes, backend='networkx', weight='cost', workers=1, contract=False, footprint=None):
+    """Route the homes of every FDH, yielding (fdh_id, fdh_node, home, path) tuples.
+
+    fdh_homes is a list of (fdh_id, fdh_node, homes). Paths run from the home to the FDH
+    and are None for unreachable homes. The 'networkx' backend grows one tree per FDH over
+    G; the 'csgraph' backend compiles edges_gdf to CSR and grows the trees of many FDHs in
+    each scipy.sparse.csgraph.dijkstra call. Nodes marked terminal in G are terminal in both.
+    With workers > 1 the csgraph backend is used and FDH groups are routed in parallel.
+    With contract, both route over the chains of contract_chains and every path is expanded
+    back to the nodes of edges_gdf, so callers see the same paths either way.
+
+    With a positive footprint distance, each FDH is routed over only the edges within that distance
+    of the convex hull around the edges at its homes and its node, found through the
+    edges_gdf spatial index. The distance doubles until every home is reached or the whole
+    graph is used, so routes only leave the cluster when they must. With workers > 1 the
+    FDHs are spread over forked worker processes, each compiling just its own subgraph.
+    """
+    if footprint is not None:
+        global _footprint_job
+        if not footprint > 0:
+            # Doubling a buffer of zero never widens it, so an unreachable home would loop forever
+            raise ValueError(f"The footprint buffer must be a positive distance, got {footprint}.")
+        # The spatial index and the edges at every node are built once, before any fork
+        edges_gdf.sindex
+        touching = pd.Series(np.tile(np.arange(len(edges_gdf)), 2), index=np.concatenate((edges_gdf['start_node'].to_numpy(), edges_gdf['end_node'].to_numpy())))
+        bounds = edges_gdf.total_bounds
+        extent = shapely.box(*bounds) if np.isfinite(bounds).all() else None
+        job = (G, edges_gdf, touching, extent, 'csgraph' if workers > 1 else backend, weight, contract, footprint)
+        if workers <= 1:
+            for entry in fdh_homes:
+                yield from _route_footprint(job, entry)
+            return
+        _footprint_job = job
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            for routes in executor.map(_route_shared_footprint, fdh_homes):
+                yield from routes
+        return
+
+    terminal_nodes = [node for node, terminal in G.nodes(data='terminal') if terminal]
+    if contract:
+        # Routes start and end at FDHs and homes, so those nodes must survive the contraction
+        keep_nodes = set(terminal_nodes)
+        for _, fdh_node, homes in fdh_homes:
+            keep_nodes.add(fdh_node)
+            keep_nodes.update(homes)
+        chains = contract_chains(edges_gdf, keep_nodes, weight)
+        chain_nodes = {}
+        for nodes in chains['nodes']:
+            chain_nodes[nodes[0], nodes[-1]] = nodes
+            chain_nodes[nodes[-1], nodes[0]] = nodes[::-1]
+        edges_gdf = chains
+        if backend != 'csgraph' and workers <= 1:
+            G = nx.Graph()
+            G.add_weighted_edges_from(zip(chains['start_node'], chains['end_node'], chains[weight]), weight=weight)
+            nx.set_node_attributes(G, dict.fromkeys(terminal_nodes, True), 'terminal')
+
+    if backend == 'csgraph' or workers > 1:
+        graph = CompiledGraph(edges_gdf, weight=weight, terminal_nodes=terminal_nodes)
+        routes = graph.route_fdh_trees(fdh_homes, workers)
+    else:
+        routes = ((fdh_id, fdh_node, home, path) for fdh_id, fdh_node, homes in fdh_homes for home, path in route_fdh_tree(G, fdh_node, homes, weight))
+
+    for fdh_id, fdh_node, home, path in routes:
+        if contract and path is not None:
+            path = expand_path(path, chain_nodes)
+        yield fdh_id, fdh_node, home, path
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import fcluster, linkage
+from cluster_fdh_v2 import WARD_MAX_HOMES, bisect_clusters, find_distance_threshold, save_clusters
+
+# Constants
+FDH_SIZES = [288, 432, 576]  # Cabinet sizes (max homes per FDH) to compare
+ROUTING_SCRIPT = 'create_network_v2.py'  # Downstream routing run in each variant folder
+SWEEP_DIR = 'fdh_sweep'
+SHARED_INPUTS = ['edges', 'nodes']  # Shapefiles every variant routes over unchanged
+SHAPEFILE_PARTS = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+
+def copy_shapefile(name, folder):
+    """Copy every part of a shapefile into folder."""
+    for ext in SHAPEFILE_PARTS:
+        if os.path.exists(name + ext):
+            shutil.copy(name + ext, os.path.join(folder, name + ext))
+
+def route_variant(folder):
+    """Run the routing script in a variant folder as its own process."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), ROUTING_SCRIPT)
+    with open(os.path.join(folder, 'routing.log'), 'w') as log:
+        result = subprocess.run([sys.executable, script], cwd=folder, stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode
+
+def summarize_variant(size, folder):
+    """Summarize FDH count, footage and cost of one routed variant."""
+    network_gdf = gpd.read_file(os.path.join(folder, 'network.shp'))
+    home_points_gdf = gpd.read_file(os.path.join(folder, 'home_points.shp'))
+    feet = network_gdf.geometry.length.groupby(network_gdf['type']).sum()
+    homes_passed = len(home_points_gdf)
+    total_cost = network_gdf['cost'].sum()
+    return {
+        'Max Homes': size,
+        'FDHs': home_points_gdf['fdh_id'].nunique(),
+        'HP': homes_passed,
+        'Aerial': round(feet.get('Aerial', 0)),
+        'Underground': round(feet.get('Underground', 0) + feet.get('Transition', 0)),
+        'Drops': round(feet.get('Aerial Drop', 0) + feet.get('Buried Drop', 0)),
+        'Total Cost': round(total_cost),
+        'Cost per HP': round(total_cost / homes_passed, 2) if homes_passed > 0 else 0,
+    }
+
+print("Clustering homes for each FDH size...")
+
+homes = gpd.read_file('home_points.shp')
+nodes = gpd.read_file('nodes.shp')
+coordinates = np.column_stack((homes.geometry.x.values, homes.geometry.y.values))
+
+# The linkage matrix is the expensive part, so it is computed once and cut at each size
+Z = linkage(coordinates, method='ward') if len(coordinates) <= WARD_MAX_HOMES else None
+
+os.makedirs(SWEEP_DIR, exist_ok=True)
+folders = {}
+for size in FDH_SIZES:
+    folder = os.path.join(SWEEP_DIR, f'fdh_{size}')
+    os.makedirs(folder, exist_ok=True)
+    if Z is not None:
+        distance_threshold = find_distance_threshold(Z, size)
+        if distance_threshold is None:
+            print(f"Unable to find a suitable distance threshold for {size} homes per FDH. Skipping.")
+            continue
+        clusters = fcluster(Z, t=distance_threshold, criterion='distance')
+    else:
+        clusters = bisect_clusters(coordinates, size)
+    save_clusters(homes, nodes, coordinates, clusters, os.path.join(folder, 'home_points.shp'), os.path.join(folder, 'fdh.shp'))
+    for name in SHARED_INPUTS:
+        copy_shapefile(name, folder)
+    folders[size] = folder
+
+print(f"Routing {len(folders)} variants in parallel...")
+
+# Each worker thread only waits on its own routing process
+with ThreadPoolExecutor(max_workers=max(1, min(len(folders), os.cpu_count() or 1))) as executor:
+    return_codes = dict(zip(folders, executor.map(route_variant, folders.values())))
+
+summary = []
+for size, folder in folders.items():
+    if return_codes[size] != 0:
+        print(f"Routing failed for {size} homes per FDH; see {os.path.join(folder, 'routing.log')}.")
+        continue
+    summary.append(summarize_variant(size, folder))
+
+summary_df = pd.DataFrame(summary)
+print(summary_df.to_string(index=False))
+
+summary_df.to_excel('fdh_sweep.xlsx', index=False, engine='openpyxl')
+print("FDH size comparison has been saved to fdh_sweep.xlsx.")